@@ -0,0 +1,134 @@
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+from route_calculators import CompactRouteCalculator
+from data_gui_processing import load_processed_routes
+from plotting import render_graph_image
+
+TRAVEL_TIME_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9]
+FLOW_CLASS_WIDTHS = [1, 2, 4, 7]
+MINUTE_NS = 60 * 10 ** 9
+
+
+class NetworkAnalytics:
+    # Network-wide flows over adjust_routes output (in memory or loaded with load_processed_routes).
+    # Routes are flattened into one hop array with integer camera codes, so every table is a grouped
+    # reduction over numpy arrays and only holds the camera pairs that occur (a sparse matrix in
+    # coordinate form). Hop k of a trip goes from route[k] to route[k + 1] and takes times[k] minutes.
+    # Departures are worked back from exit_date, because the first time of a trip that follows a gap
+    # holds that gap. Hops that stay at one camera are repeated reads, not travel, and are left out.
+    def __init__(self, data: pd.DataFrame):
+        calculator = CompactRouteCalculator()
+        cameras, route_lengths = calculator.flatten_list_column(data['route'], dtype=object)
+        times, times_lengths = calculator.flatten_list_column(data['times'], dtype=np.float64)
+        camera_codes, self.cameras = pd.factorize(cameras)
+
+        has_route = route_lengths > 0
+        trip_starts = np.cumsum(route_lengths) - route_lengths
+        self.origins = camera_codes[trip_starts[has_route]]
+        self.destinations = camera_codes[(trip_starts + route_lengths - 1)[has_route]]
+
+        trip_of_camera = np.repeat(np.arange(len(data)), route_lengths)
+        hop_positions = np.flatnonzero(np.arange(len(cameras)) > trip_starts[trip_of_camera])
+        hop_trips = trip_of_camera[hop_positions]
+        hop_numbers = hop_positions - trip_starts[hop_trips] - 1
+
+        # Minutes from each hop's departure to the end of its trip: the trip's total time minus
+        # the times of the hops before it.
+        times = np.nan_to_num(times)
+        times_starts = np.cumsum(times_lengths) - times_lengths
+        times_before = np.cumsum(times) - times
+        trip_totals = np.zeros(len(data))
+        trip_totals[times_lengths > 0] = (times_before + times)[(times_starts + times_lengths - 1)[times_lengths > 0]]
+
+        has_time = hop_numbers < times_lengths[hop_trips]
+        time_positions = times_starts[hop_trips] + hop_numbers
+        hop_times = np.full(len(hop_positions), np.nan)
+        hop_times[has_time] = times[time_positions[has_time]]
+        remaining = np.full(len(hop_positions), np.nan)
+        remaining[has_time] = trip_totals[hop_trips[has_time]] - times_before[time_positions[has_time]]
+
+        exit_dates = pd.to_datetime(data['exit_date']).to_numpy(dtype='datetime64[ns]').astype(np.int64)[hop_trips]
+        departures = exit_dates - np.nan_to_num(remaining * MINUTE_NS).astype(np.int64)
+        hours = (departures // (3600 * 10 ** 9)) % 24
+
+        hops = pd.DataFrame({
+            'source': camera_codes[hop_positions - 1],
+            'target': camera_codes[hop_positions],
+            'time': hop_times,
+            'hour': np.where(has_time, hours, -1),
+        })
+        self.hops = hops[hops['source'] != hops['target']]
+
+    def origin_destination(self) -> pd.DataFrame:
+        pairs, trips = np.unique(self.origins.astype(np.int64) * len(self.cameras) + self.destinations, return_counts=True)
+        table = pd.DataFrame({'origin': pairs // len(self.cameras), 'destination': pairs % len(self.cameras), 'trips': trips})
+        return self.label_cameras(table, ['origin', 'destination']).sort_values(['origin', 'destination'], ignore_index=True)
+
+    def edge_flows(self) -> pd.DataFrame:
+        return self.summarize_travel_times(['source', 'target'])
+
+    def edge_hourly_travel_times(self) -> pd.DataFrame:
+        hops = self.hops[self.hops['hour'] >= 0]
+        return self.summarize_travel_times(['source', 'target', 'hour'], hops)
+
+    def summarize_travel_times(self, keys, hops=None):
+        hops = self.hops if hops is None else hops
+        grouped = hops.groupby(keys, sort=True)['time']
+        summary = grouped.agg(flow='size', mean_time='mean')
+        quantiles = grouped.quantile(TRAVEL_TIME_QUANTILES).unstack()
+        quantiles.columns = [f'time_p{round(quantile * 100)}' for quantile in quantiles.columns]
+        summary = self.label_cameras(summary.join(quantiles).reset_index(), ['source', 'target'])
+        return summary.sort_values(keys, ignore_index=True)
+
+    def label_cameras(self, table, columns):
+        return table.assign(**{column: self.cameras[table[column].to_numpy()] for column in columns})
+
+
+def build_network_graphs(edge_flows: pd.DataFrame):
+    # Graphs in the build_plate_graphs format, one per flow class (by quantile of flow), each drawn
+    # with its own width and colour by the plotting module.
+    if edge_flows.empty:
+        return []
+    flow_ranks = edge_flows['flow'].rank(method='first', pct=True).to_numpy()
+    flow_classes = np.minimum((flow_ranks * len(FLOW_CLASS_WIDTHS)).astype(int), len(FLOW_CLASS_WIDTHS) - 1)
+
+    graphs = []
+    for flow_class, width in enumerate(FLOW_CLASS_WIDTHS):
+        edges = edge_flows[flow_classes == flow_class]
+        sources, targets = edges['source'].astype(str).tolist(), edges['target'].astype(str).tolist()
+        links = [{"source": source, "target": target, "time": float(time), "flow": int(flow)}
+                 for source, target, time, flow in zip(sources, targets, edges['time_p50'], edges['flow'])]
+        graphs.append({"nodes": [{"id": node} for node in sorted(set(sources) | set(targets))], "links": links,
+                       "width": width})
+    return graphs
+
+
+def render_network_image(data: pd.DataFrame, layout=None, fast=False):
+    return render_graph_image(build_network_graphs(NetworkAnalytics(data).edge_flows()), layout, fast=fast)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write network-wide flow and travel-time tables for processed routes.")
+    parser.add_argument('input', help="Processed routes (.csv, .parquet or .arrow)")
+    parser.add_argument('--output-dir', required=True)
+    parser.add_argument('--image', help="Also render the network flow graph to this PNG")
+    parser.add_argument('--fast', action='store_true', help="Render the image with the lightweight rasterizer")
+    args = parser.parse_args(argv)
+
+    data = load_processed_routes(args.input, columns=['num_plate', 'route', 'times', 'entry_date', 'exit_date'])
+    analytics = NetworkAnalytics(data)
+    os.makedirs(args.output_dir, exist_ok=True)
+    edge_flows = analytics.edge_flows()
+    edge_flows.to_csv(os.path.join(args.output_dir, 'edge_flows.csv'), index=False)
+    analytics.origin_destination().to_csv(os.path.join(args.output_dir, 'origin_destination.csv'), index=False)
+    analytics.edge_hourly_travel_times().to_csv(os.path.join(args.output_dir, 'edge_hourly_travel_times.csv'), index=False)
+    if args.image:
+        with open(args.image, 'wb') as f:
+            f.write(render_graph_image(build_network_graphs(edge_flows), fast=args.fast))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+import argparse
+import glob
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+
+from correctors import CORRECTORS
+from route_calculators import ROUTE_CALCULATORS
+from data_processor import DataProcessor, DEFAULT_MEMORY_BUDGET_MB, DEFAULT_SAMPLE_FRACTION
+from data_gui_processing import generate_insertions
+from incremental import IncrementalProcessor
+from instrumentation import StageInstrumentation, InMemorySink, JsonLinesSink
+from input_cache import ParsedInputCache, DEFAULT_CACHE_SIZE_MB
+from plate_store import PlateStore, DEFAULT_MAX_AGE_DAYS
+
+OUTPUT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+TIMING_SUMMARY_FILE = 'timing_summary.csv'
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Process LPR detection files without the GUI.")
+    parser.add_argument('inputs', nargs='+', help="CSV files, directories of CSV files or glob patterns")
+    parser.add_argument('--output-dir', required=True, help="Directory for processed routes and the timing summary")
+    parser.add_argument('--algorithm', choices=sorted(CORRECTORS), default='levenshtein')
+    parser.add_argument('--normalize', action='store_true', help="Normalize plates before correcting them")
+    parser.add_argument('--route-calculator', choices=sorted(ROUTE_CALCULATORS), default='vectorized')
+    parser.add_argument('--max-time-between-trips', type=int, default=1440, help="Minutes")
+    parser.add_argument('--route', default='', help="Comma separated camera route used for insertions")
+    parser.add_argument('--compact', action='store_true', help="Use the compact typed schema and Arrow list "
+                                                              "routes (implies --route-calculator compact)")
+    parser.add_argument('--format', choices=sorted(OUTPUT_EXTENSIONS), default='csv')
+    parser.add_argument('--workers', type=int, help="Files processed concurrently (default: one per CPU)")
+    parser.add_argument('--route-workers', type=int, default=1, help="Processes used to build the routes of each file")
+    parser.add_argument('--streaming', action='store_true', help="Process whole files in streaming mode")
+    parser.add_argument('--memory-budget-mb', type=float, default=DEFAULT_MEMORY_BUDGET_MB)
+    parser.add_argument('--sample-fraction', type=float, default=1.0,
+                        help=f"Only process this leading share of each file's rows, e.g. {DEFAULT_SAMPLE_FRACTION} for a "
+                             "quick look (default: the whole file; streaming mode always keeps all rows)")
+    parser.add_argument('--state-dir', help="Incremental mode: process files in name order, carrying open trips "
+                                            "and known plates between runs in this directory")
+    parser.add_argument('--metrics-file', help="Append per-stage metrics events to this JSON-lines file")
+    parser.add_argument('--profile-stage', help="Run this stage under cProfile and write <file>_<stage>.prof "
+                                                "to the output directory")
+    parser.add_argument('--date-format', help="strftime format of the date column, e.g. '%%Y-%%m-%%d %%H:%%M:%%S' "
+                                              "(inferred when omitted)")
+    parser.add_argument('--cache-dir', help="Cache parsed inputs as memory-mapped Arrow files in this directory")
+    parser.add_argument('--cache-size-mb', type=float, default=DEFAULT_CACHE_SIZE_MB)
+    parser.add_argument('--plate-store', help="Directory of known clean plates and memoized corrections shared "
+                                              "across runs")
+    parser.add_argument('--plate-max-age-days', type=float, default=DEFAULT_MAX_AGE_DAYS,
+                        help="Forget plates and corrections not seen for this many days")
+    parser.add_argument('--flush', action='store_true', help="Incremental mode: close all open trips at the end")
+    args = parser.parse_args(argv)
+
+    if args.state_dir:
+        # Incremental mode reads every batch whole, in order, with the detection schema of its state.
+        unsupported = [option for option, used in [
+            ('--workers', args.workers is not None),
+            ('--streaming', args.streaming),
+            ('--compact', args.compact),
+            ('--sample-fraction', args.sample_fraction != 1.0),
+            ('--route-calculator simple', args.route_calculator == 'simple'),
+        ] if used]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --state-dir")
+    return args
+
+
+def find_input_files(inputs):
+    filepaths = []
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            filepaths.extend(glob.glob(os.path.join(pattern, '*.csv')))
+        else:
+            filepaths.extend(glob.glob(pattern))
+    return sorted(set(filepaths))
+
+
+def get_output_path(filepath, args):
+    output_name = os.path.splitext(os.path.basename(filepath))[0] + OUTPUT_EXTENSIONS[args.format]
+    return os.path.join(args.output_dir, output_name)
+
+
+def get_insertions(args):
+    return generate_insertions([node.strip() for node in args.route.split(',')])
+
+
+def create_instrumentation(filepath, args):
+    profile_output = None
+    if args.profile_stage:
+        name = os.path.splitext(os.path.basename(filepath))[0]
+        profile_output = os.path.join(args.output_dir, f'{name}_{args.profile_stage}.prof')
+    return StageInstrumentation(InMemorySink(), args.profile_stage, profile_output, context={'file': filepath})
+
+
+def summarize_stages(events):
+    timings = {}
+    for event in events:
+        if event['event'] == 'stage_finished':
+            key = f"{event['stage']}_seconds"
+            timings[key] = timings.get(key, 0) + event['wall_seconds']
+    return timings
+
+
+def process_file(filepath, args):
+    corrector = CORRECTORS[args.algorithm](normalize=args.normalize)
+    route_calculator = ROUTE_CALCULATORS['compact' if args.compact else args.route_calculator]()
+    instrumentation = create_instrumentation(filepath, args)
+    processor = DataProcessor(filepath, corrector, route_calculator, memory_budget_mb=args.memory_budget_mb,
+                              sample_fraction=args.sample_fraction, instrumentation=instrumentation,
+                              compact=args.compact, date_format=args.date_format,
+                              input_cache=ParsedInputCache(args.cache_dir, args.cache_size_mb) if args.cache_dir else None,
+                              plate_store=PlateStore(args.plate_store, args.plate_max_age_days) if args.plate_store else None,
+                              route_workers=args.route_workers)
+    insertions = get_insertions(args)
+    output_path = get_output_path(filepath, args)
+
+    start = time.perf_counter()
+    if args.streaming:
+        # Trips are written partition by partition, so the whole result is never held in memory.
+        trips = processor.process_streaming(args.max_time_between_trips, insertions, output_path=output_path)
+    else:
+        processor.load_and_prepare_data()
+        processor.correct_num_plates_and_remove_hashes()
+        processor.calculate_and_adjust_routes(args.max_time_between_trips, insertions)
+        processor.verify_and_classify_visits()
+        processor.save_processed_data(output_path)
+        trips = len(processor.data)
+
+    events = instrumentation.sink.events
+    summary = {'file': filepath, 'output': output_path, **summarize_stages(events),
+               'total_seconds': time.perf_counter() - start, 'trips': trips}
+    # Workers read the store; the parent merges what each one recorded and saves it once.
+    plate_updates = processor.plate_store.updates if processor.plate_store is not None else []
+    return summary, events, plate_updates
+
+
+def process_files_incrementally(filepaths, args):
+    processor = IncrementalProcessor(args.state_dir, CORRECTORS[args.algorithm](normalize=args.normalize),
+                                     ROUTE_CALCULATORS[args.route_calculator](), date_format=args.date_format,
+                                     plate_store=PlateStore(args.plate_store, args.plate_max_age_days) if args.plate_store else None,
+                                     input_cache=ParsedInputCache(args.cache_dir, args.cache_size_mb) if args.cache_dir else None,
+                                     route_workers=args.route_workers)
+    metrics_sink = JsonLinesSink(args.metrics_file) if args.metrics_file else None
+    profile_output = os.path.join(args.output_dir, f'{args.profile_stage}.prof') if args.profile_stage else None
+    processor.instrumentation = StageInstrumentation(metrics_sink, args.profile_stage, profile_output)
+    insertions = get_insertions(args)
+    summaries = []
+
+    for filepath in filepaths:
+        start = time.perf_counter()
+        processor.process_batch(filepath, args.max_time_between_trips, insertions)
+        output_path = get_output_path(filepath, args)
+        processor.save_processed_data(output_path)
+        summaries.append({'file': filepath, 'output': output_path, 'total_seconds': time.perf_counter() - start,
+                          'trips': len(processor.data), 'open_trip_detections': len(processor.open_trip_detections),
+                          'status': 'ok'})
+        print(f"{filepath}: ok")
+
+    if args.flush:
+        processor.flush(args.max_time_between_trips, insertions)
+        output_path = os.path.join(args.output_dir, 'flushed' + OUTPUT_EXTENSIONS[args.format])
+        processor.save_processed_data(output_path)
+        summaries.append({'file': None, 'output': output_path, 'trips': len(processor.data), 'status': 'ok'})
+
+    return summaries
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    filepaths = find_input_files(args.inputs)
+    if not filepaths:
+        raise SystemExit("No input files found.")
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.state_dir:
+        write_summary(process_files_incrementally(filepaths, args), args)
+        return
+
+    summaries = []
+    plate_updates = []
+    metrics_sink = JsonLinesSink(args.metrics_file) if args.metrics_file else None
+    with ProcessPoolExecutor(max_workers=max(1, args.workers or os.cpu_count())) as executor:
+        futures = {executor.submit(process_file, filepath, args): filepath for filepath in filepaths}
+        for future in as_completed(futures):
+            filepath = futures[future]
+            try:
+                summary, events, file_plate_updates = future.result()
+                plate_updates += file_plate_updates
+                summary['status'] = 'ok'
+                if metrics_sink is not None:
+                    for event in events:
+                        metrics_sink.emit(event)
+            except Exception as error:
+                summary = {'file': filepath, 'status': f'error: {error}'}
+            print(f"{filepath}: {summary['status']}")
+            summaries.append(summary)
+
+    if args.plate_store:
+        plate_store = PlateStore(args.plate_store, args.plate_max_age_days)
+        for plates, memo in plate_updates:
+            plate_store.apply_updates(plates, memo)
+        plate_store.save()
+
+    write_summary(sorted(summaries, key=lambda summary: summary['file']), args)
+
+
+def write_summary(summaries, args):
+    summary_path = os.path.join(args.output_dir, TIMING_SUMMARY_FILE)
+    pd.DataFrame(summaries).to_csv(summary_path, index=False)
+    print(f"Timing summary written to {summary_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+
+from correctors import CORRECTORS
+from route_calculators import ROUTE_CALCULATORS
+from data_processor import DataProcessor
+from data_gui_processing import generate_insertions, convert_plate_to_graphs_json, build_plate_graphs, load_processed_routes
+from plotting import build_plotly_figure, rasterize_graph_image
+from synthetic_data import generate_detections
+
+SCALES = {
+    'small': dict(num_plates=1000, reads_per_plate=20, num_cameras=50),
+    'medium': dict(num_plates=10000, reads_per_plate=20, num_cameras=200),
+    'large': dict(num_plates=100000, reads_per_plate=20, num_cameras=500),
+}
+GRAPH_SAMPLE_PLATES = 20
+MAX_TIME_BETWEEN_TRIPS = 60
+
+
+def measure(function, profile_memory):
+    # Times the call; with profile_memory, runs it a second time under tracemalloc for the peak,
+    # so tracing overhead does not distort the timing.
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    peak_memory_mb = None
+    if profile_memory:
+        tracemalloc.start()
+        function()
+        peak_memory_mb = tracemalloc.get_traced_memory()[1] / (1024 * 1024)
+        tracemalloc.stop()
+    return result, seconds, peak_memory_mb
+
+
+def run_scale(scale, work_dir, algorithm, profile_memory, seed):
+    parameters = SCALES[scale]
+    input_path = os.path.join(work_dir, f'{scale}.csv')
+    generate_detections(seed=seed, **parameters).to_csv(input_path, index=False)
+    # Keyed like the synthetic camera_ID column (integers), so adjust_routes really inserts cameras.
+    insertions = generate_insertions(list(range(1, parameters['num_cameras'] + 1)))
+    corrector = CORRECTORS[algorithm]()
+    results = []
+
+    def record(stage, function, rows_in):
+        result, seconds, peak_memory_mb = measure(function, profile_memory)
+        results.append({'scale': scale, 'stage': stage, 'seconds': seconds, 'peak_memory_mb': peak_memory_mb,
+                        'rows_in': rows_in, 'rows_out': len(result) if hasattr(result, '__len__') else None})
+        print(f"{scale:>8} {stage:<40} {seconds:10.3f}s")
+        return result
+
+    def load():
+        processor = DataProcessor(input_path, corrector, ROUTE_CALCULATORS['vectorized'](), sample_fraction=1.0)
+        processor.load_and_prepare_data()
+        return processor.data
+
+    detections = record('load_and_prepare_data', load, None)
+    corrected = record('correct_num_plates', lambda: corrector.correct_num_plates(detections.copy()), len(detections))
+
+    processor = DataProcessor(input_path, corrector, None)
+    processor.data = corrected.sort_values(by=['num_plate', 'date'])
+    processor.remove_invalid_plates()
+    clean = processor.data
+
+    adjusted_routes = {}
+    for name, route_calculator_class in sorted(ROUTE_CALCULATORS.items()):
+        route_calculator = route_calculator_class()
+        trips = record(f'calculate_routes[{name}]',
+                       lambda: route_calculator.calculate_routes(clean, MAX_TIME_BETWEEN_TRIPS), len(clean))
+        adjusted_routes[name] = record(f'adjust_routes[{name}]', lambda: route_calculator.adjust_routes(trips, insertions),
+                                       len(trips))
+    adjusted = adjusted_routes['vectorized']
+
+    # Compact routes keep Arrow list columns; saving them as parquet/arrow must load back unchanged.
+    compact = adjusted_routes['compact']
+    for extension in ('parquet', 'arrow'):
+        round_trip_path = os.path.join(work_dir, f'{scale}_processed.{extension}')
+        loaded = record(f'save_and_load_processed[{extension}]',
+                        lambda: save_and_load_processed(compact, round_trip_path), len(compact))
+        check_round_trip(compact, loaded, round_trip_path)
+
+    processed_path = os.path.join(work_dir, f'{scale}_processed.csv')
+    adjusted.to_csv(processed_path, index=False)
+    plates = adjusted['num_plate'].drop_duplicates().head(GRAPH_SAMPLE_PLATES).tolist()
+    json_path = os.path.join(work_dir, 'graphs_data.json')
+    record('convert_plate_to_graphs_json', lambda: [convert_plate_to_graphs_json(processed_path, plate, json_path)
+                                                    for plate in plates], len(adjusted))
+
+    graphs = [build_plate_graphs(adjusted[adjusted['num_plate'] == plate]) for plate in plates]
+    record('plotting.build_plotly_figure', lambda: [build_plotly_figure(plate_graphs) for plate_graphs in graphs], len(graphs))
+    record('plotting.rasterize_graph_image', lambda: [rasterize_graph_image(plate_graphs) for plate_graphs in graphs], len(graphs))
+    return results
+
+
+def save_and_load_processed(data, path):
+    processor = DataProcessor(path, None, None)
+    processor.data = data
+    processor.save_processed_data(path)
+    return load_processed_routes(path)
+
+
+def check_round_trip(data, loaded, path):
+    for column in ('num_plate', 'route', 'times', 'entry_date', 'exit_date'):
+        expected = [list(value) if column in ('route', 'times') else value for value in data[column]]
+        actual = [list(value) if column in ('route', 'times') else value for value in loaded[column]]
+        if expected != actual:
+            raise RuntimeError(f"{path}: column {column} changed on save and load")
+
+
+def compare_results(results, baseline_path):
+    if not os.path.exists(baseline_path):
+        print(f"No earlier results in {baseline_path} to compare against")
+        return
+    with open(baseline_path) as f:
+        baseline = {(entry['scale'], entry['stage']): entry for entry in map(json.loads, f)}
+    for result in results:
+        previous = baseline.get((result['scale'], result['stage']))
+        if previous and previous['seconds']:
+            ratio = result['seconds'] / previous['seconds']
+            print(f"{result['scale']:>8} {result['stage']:<40} {ratio:6.2f}x vs {previous['label']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark every pipeline stage on synthetic LPR data.")
+    parser.add_argument('--scales', nargs='+', choices=list(SCALES), default=['small'])
+    parser.add_argument('--algorithm', choices=sorted(CORRECTORS), default='levenshtein')
+    parser.add_argument('--memory', action='store_true', help="Also record the tracemalloc peak of each stage")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--label', default='current', help="Name of the version being measured")
+    parser.add_argument('--output', default='benchmark_results.jsonl', help="JSON-lines file results are appended to")
+    parser.add_argument('--compare', help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    results = []
+    with tempfile.TemporaryDirectory() as work_dir:
+        for scale in args.scales:
+            results += run_scale(scale, work_dir, args.algorithm, args.memory, args.seed)
+
+    # Compared before appending: --compare may name the --output file, which must not hold this run yet.
+    if args.compare:
+        compare_results(results, args.compare)
+
+    metadata = {'label': args.label, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'algorithm': args.algorithm,
+                'python': platform.python_version(), 'pandas': pd.__version__, 'seed': args.seed}
+    with open(args.output, 'a') as f:
+        for result in results:
+            f.write(json.dumps({**metadata, **result}) + '\n')
+
+
+if __name__ == "__main__":
+    main()
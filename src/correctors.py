@@ -1,43 +1,214 @@
 from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import math
+import numpy as np
 import pandas as pd
 import re
 from tqdm import tqdm
 import textdistance
 
+
+QGRAM_SIZE = 2
+# q-grams one edit can change: QGRAM_SIZE for a substitution, insertion or deletion, one more for a
+# transposition of adjacent characters.
+QGRAM_EDIT_COST = QGRAM_SIZE + 1
+
+
+def bounded_edit_distance(source, target, max_distance, transpositions=False):
+    # Returns the exact distance when it is <= max_distance, otherwise max_distance + 1.
+    if abs(len(source) - len(target)) > max_distance:
+        return max_distance + 1
+
+    previous_previous_row = None
+    previous_row = list(range(len(target) + 1))
+    for i in range(1, len(source) + 1):
+        current_row = [i] + [0] * len(target)
+        for j in range(1, len(target) + 1):
+            cost = 0 if source[i - 1] == target[j - 1] else 1
+            current_row[j] = min(previous_row[j] + 1, current_row[j - 1] + 1, previous_row[j - 1] + cost)
+            if (transpositions and i > 1 and j > 1 and source[i - 1] == target[j - 2]
+                    and source[i - 2] == target[j - 1]):
+                current_row[j] = min(current_row[j], previous_previous_row[j - 2] + 1)
+
+        row_minimum = min(current_row)
+        if transpositions:
+            row_minimum = min(row_minimum, min(previous_row))
+        if row_minimum > max_distance:
+            return max_distance + 1
+        previous_previous_row, previous_row = previous_row, current_row
+
+    return previous_row[-1] if previous_row[-1] <= max_distance else max_distance + 1
+
+
+def qgram_keys(plate):
+    # Each q-gram with its occurrence number, so plates share as many keys as q-grams (with repeats).
+    occurrences = defaultdict(int)
+    keys = []
+    for i in range(len(plate) - QGRAM_SIZE + 1):
+        qgram = plate[i:i + QGRAM_SIZE]
+        keys.append((qgram, occurrences[qgram]))
+        occurrences[qgram] += 1
+    return keys
+
+
+class CleanPlateIndex:
+    def __init__(self, plates):
+        self.first_seen = {}
+        self.plates_by_length = defaultdict(list)
+        self.entries = []
+        self.postings = defaultdict(list)
+        self.alphabet = set()
+        for order, plate in enumerate(plates):
+            if plate not in self.first_seen:
+                self.first_seen[plate] = order
+                self.plates_by_length[len(plate)].append((order, plate))
+                for key in qgram_keys(plate):
+                    self.postings[key].append(len(self.entries))
+                self.entries.append(plate)
+                self.alphabet.update(plate)
+
+    def find_nearest(self, plate, max_distance, bounded_distance):
+        if plate in self.first_seen:
+            return plate, 0
+
+        # q-gram count filter. Characters no indexed plate has (the non-alphanumerics of a dirty plate)
+        # each take an edit of their own that only touches q-grams no plate has either; each other edit
+        # changes at most QGRAM_EDIT_COST q-grams. So a plate within distance d shares at least
+        # known - (d - unknown) * QGRAM_EDIT_COST of the plate's q-grams made of known characters.
+        keys = [key for key in qgram_keys(plate) if set(key[0]) <= self.alphabet]
+        unknown = sum(character not in self.alphabet for character in plate)
+        shared = Counter()
+        for key in keys:
+            shared.update(self.postings.get(key, ()))
+
+        # Distances are tried from the lowest possible up, so the filter is as tight as it can be and
+        # the first plate (in first-seen order) within a distance is the nearest one.
+        for distance in range(unknown, max_distance + 1):
+            min_shared = len(keys) - (distance - unknown) * QGRAM_EDIT_COST
+            if min_shared <= 0:
+                # Too few known q-grams for the filter to rule out any plate.
+                return self.find_nearest_by_length(plate, max_distance, bounded_distance)
+            for entry in sorted(entry for entry, count in shared.items() if count >= min_shared):
+                if bounded_distance(plate, self.entries[entry], distance) <= distance:
+                    return self.entries[entry], distance
+        return None, None
+
+    def find_nearest_by_length(self, plate, max_distance, bounded_distance):
+        best_plate, best_order, bound = None, None, max_distance
+        for length_difference in range(max_distance + 1):
+            if length_difference > bound:
+                break
+            lengths = {len(plate) - length_difference, len(plate) + length_difference}
+            for length in lengths:
+                for order, candidate in self.plates_by_length.get(length, ()):
+                    distance = bounded_distance(plate, candidate, bound)
+                    if distance > bound:
+                        continue
+                    if best_plate is None or distance < bound or order < best_order:
+                        best_plate, best_order, bound = candidate, order, distance
+
+        if best_plate is None:
+            return None, None
+        return best_plate, bound
+
+
+def map_plates(plates: pd.Series, correction_map) -> pd.Series:
+    if not isinstance(plates.dtype, pd.CategoricalDtype):
+        return plates.map(correction_map).fillna(plates)
+
+    # Remap the categories and recode, keeping the categories sorted so plate order is unchanged.
+    mapped_categories = pd.Index([correction_map.get(plate, plate) for plate in plates.cat.categories])
+    categories = mapped_categories.unique().sort_values()
+    recoded = categories.get_indexer(mapped_categories)
+    codes = plates.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, recoded[codes], -1)
+    return pd.Series(pd.Categorical.from_codes(codes, categories), index=plates.index, name=plates.name)
+
+
+correction_worker_state = {}
+
+
+def init_correction_worker(corrector, clean_plate_index):
+    correction_worker_state['corrector'] = corrector
+    correction_worker_state['clean_plate_index'] = clean_plate_index
+
+
+def correct_plate_chunk(plates):
+    corrector = correction_worker_state['corrector']
+    clean_plate_index = correction_worker_state['clean_plate_index']
+    return [corrector.find_correction(plate, clean_plate_index) for plate in plates]
+
+
 class Corrector(ABC):
-    def __init__(self, normalize=False):
+    def __init__(self, normalize=False, workers=1):
         self.normalize = normalize
+        self.workers = workers
+        self.correction_map = {}
         self.NON_ALPHANUMERIC = '[^a-z0-9]'
         self.non_alphanumeric_regex = re.compile(self.NON_ALPHANUMERIC)
 
-    def correct_num_plates(self, data: pd.DataFrame) -> pd.DataFrame:
-        plates_with_non_alphanumeric = data[data['num_plate'].apply(lambda x: bool(self.non_alphanumeric_regex.search(x.lower())))]['num_plate'].unique()
-        plates_without_non_alphanumeric = data[~data['num_plate'].apply(lambda x: bool(self.non_alphanumeric_regex.search(x.lower())))]['num_plate'].unique()
-        correction_map = {}
-
-        for plate_with_non_alphanumeric in tqdm(plates_with_non_alphanumeric, desc="Correcting Plates"):
-            if self.normalize:
-                plate_with_non_alphanumeric = self.normalize_plate(plate_with_non_alphanumeric)
-            min_distance = float('inf')
-            best_match_plate = None
-
-            for plate_without_non_alphanumeric in plates_without_non_alphanumeric:
-                if self.normalize:
-                    plate_without_non_alphanumeric = self.normalize_plate(plate_without_non_alphanumeric)
-                distance = self.calculate_distance(plate_with_non_alphanumeric, plate_without_non_alphanumeric)
-                if distance < min_distance:
-                    min_distance = distance
-                    best_match_plate = plate_without_non_alphanumeric
-
-            non_alphanumeric_count = len(self.non_alphanumeric_regex.findall(plate_with_non_alphanumeric))
-            if min_distance <= non_alphanumeric_count:
+    def correct_num_plates(self, data: pd.DataFrame, known_plates=None, memo=None) -> pd.DataFrame:
+        # Classifying distinct plates (in order of appearance) also works on categorical plate columns.
+        plates = list(data['num_plate'].unique())
+        has_non_alphanumeric = [bool(self.non_alphanumeric_regex.search(plate.lower())) for plate in plates]
+        plates_with_non_alphanumeric = [plate for plate, dirty in zip(plates, has_non_alphanumeric) if dirty]
+        plates_without_non_alphanumeric = [plate for plate, dirty in zip(plates, has_non_alphanumeric) if not dirty]
+        if known_plates is not None:
+            # Plates seen in earlier runs are extra candidates; ties still favour plates in this data.
+            seen_plates = set(plates_without_non_alphanumeric)
+            plates_without_non_alphanumeric += [plate for plate in known_plates if plate not in seen_plates]
+        if self.normalize:
+            plates_without_non_alphanumeric = [self.normalize_plate(plate) for plate in plates_without_non_alphanumeric]
+        clean_plate_index = CleanPlateIndex(plates_without_non_alphanumeric)
+
+        # Misreads corrected in earlier runs (keyed like correction_map) resolve without a search.
+        remembered = []
+        if memo:
+            keys = [self.normalize_plate(plate) if self.normalize else plate for plate in plates_with_non_alphanumeric]
+            remembered = [(key, memo[key]) for key in keys if key in memo]
+            plates_with_non_alphanumeric = [plate for plate, key in zip(plates_with_non_alphanumeric, keys) if key not in memo]
+
+        if self.workers > 1 and len(plates_with_non_alphanumeric) > 1:
+            corrections = self.find_corrections_in_parallel(plates_with_non_alphanumeric, clean_plate_index)
+        else:
+            corrections = (self.find_correction(plate, clean_plate_index)
+                           for plate in tqdm(plates_with_non_alphanumeric, desc="Correcting Plates"))
+
+        # Corrections arrive in dirty-plate order, so later duplicates win exactly as in the serial loop.
+        correction_map = dict(remembered)
+        for plate_with_non_alphanumeric, best_match_plate in corrections:
+            if best_match_plate is not None:
                 correction_map[plate_with_non_alphanumeric] = best_match_plate
 
-        for plate_with_non_alphanumeric, plate_corrected in correction_map.items():
-            data.loc[data['num_plate'] == plate_with_non_alphanumeric, 'num_plate'] = plate_corrected
+        self.correction_map = correction_map
+        if correction_map:
+            data['num_plate'] = map_plates(data['num_plate'], correction_map)
 
         return data
 
+    def find_correction(self, plate_with_non_alphanumeric, clean_plate_index):
+        if self.normalize:
+            plate_with_non_alphanumeric = self.normalize_plate(plate_with_non_alphanumeric)
+
+        non_alphanumeric_count = len(self.non_alphanumeric_regex.findall(plate_with_non_alphanumeric))
+        best_match_plate, _ = clean_plate_index.find_nearest(plate_with_non_alphanumeric, non_alphanumeric_count,
+                                                             self.calculate_bounded_distance)
+        return plate_with_non_alphanumeric, best_match_plate
+
+    def find_corrections_in_parallel(self, plates_with_non_alphanumeric, clean_plate_index):
+        chunk_size = max(1, math.ceil(len(plates_with_non_alphanumeric) / (self.workers * 4)))
+        chunks = [plates_with_non_alphanumeric[i:i + chunk_size]
+                  for i in range(0, len(plates_with_non_alphanumeric), chunk_size)]
+
+        corrections = []
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=init_correction_worker,
+                                 initargs=(self, clean_plate_index)) as executor:
+            for chunk_corrections in tqdm(executor.map(correct_plate_chunk, chunks), total=len(chunks),
+                                          desc="Correcting Plates"):
+                corrections.extend(chunk_corrections)
+        return corrections
+
     def normalize_plate(self, plate: str) -> str:
         normalized_plate = self.non_alphanumeric_regex.sub('', plate.lower())
         return normalized_plate
@@ -46,10 +217,27 @@ class Corrector(ABC):
     def calculate_distance(self, plate_with_non_alphanumeric, plate_without_non_alphanumeric) -> int:
         pass
 
+    @abstractmethod
+    def calculate_bounded_distance(self, plate_with_non_alphanumeric, plate_without_non_alphanumeric, max_distance) -> int:
+        pass
+
 class DamerauLevenshteinCorrector(Corrector):
     def calculate_distance(self, plate_with_non_alphanumeric, plate_without_non_alphanumeric) -> int:
         return textdistance.damerau_levenshtein(plate_with_non_alphanumeric, plate_without_non_alphanumeric)
 
+    def calculate_bounded_distance(self, plate_with_non_alphanumeric, plate_without_non_alphanumeric, max_distance) -> int:
+        # Restricted (optimal string alignment) variant, as used by textdistance.damerau_levenshtein.
+        return bounded_edit_distance(plate_with_non_alphanumeric, plate_without_non_alphanumeric, max_distance,
+                                     transpositions=True)
+
 class LevenshteinCorrector(Corrector):
     def calculate_distance(self, plate_with_non_alphanumeric, plate_without_non_alphanumeric) -> int:
         return textdistance.levenshtein(plate_with_non_alphanumeric, plate_without_non_alphanumeric)
+
+    def calculate_bounded_distance(self, plate_with_non_alphanumeric, plate_without_non_alphanumeric, max_distance) -> int:
+        return bounded_edit_distance(plate_with_non_alphanumeric, plate_without_non_alphanumeric, max_distance)
+
+CORRECTORS = {
+    'levenshtein': LevenshteinCorrector,
+    'damerau': DamerauLevenshteinCorrector,
+}
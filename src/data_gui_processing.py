@@ -1,37 +1,127 @@
+from collections import defaultdict
+import os
 import pandas as pd
 import json
+from caching import LRUCache
+from plotting import compute_camera_layout
 
+LIST_COLUMNS = ['route', 'times', 'directions']
+DATE_COLUMNS = ['entry_date', 'exit_date']
+GRAPH_CACHE_SIZE = 256
 
-def convert_plate_to_graphs_json(csv_path, plate, json_output_path):
-    df = pd.read_csv(csv_path)
-    print(df.columns)
-    matching_rows = df[df['num_plate'] == plate]
 
+def parse_list_column(value):
+    if not isinstance(value, str) or value.strip("[]") == "":
+        return []
+    return value.strip("[]").split(", ")
+
+
+def load_processed_routes(path, columns=None, plate=None):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.parquet':
+        filters = [('num_plate', '==', plate)] if plate is not None else None
+        return pd.read_parquet(path, columns=columns, filters=filters)
+
+    if extension in ('.arrow', '.feather'):
+        df = pd.read_feather(path, columns=columns)
+    else:
+        df = pd.read_csv(path, usecols=columns)
+        for column in LIST_COLUMNS:
+            if column in df.columns:
+                df[column] = df[column].apply(parse_list_column)
+        for column in DATE_COLUMNS:
+            if column in df.columns:
+                df[column] = pd.to_datetime(df[column])
+
+    if plate is not None:
+        df = df[df['num_plate'] == plate]
+    return df
+
+
+def build_plate_graphs(matching_rows):
     graphs = []
 
-    for _, row in matching_rows.iterrows():
-        route = row['route'].strip("[]").split(", ")
-        times = row['times'].strip("[]").split(", ")
+    for route, times in zip(matching_rows['route'], matching_rows['times']):
+        route = [str(node) for node in route]
         nodes = set(route)
         links = [{"source": route[i], "target": route[i+1], "time": float(times[i])} for i in range(len(route) - 1)]
         graphs.append({"nodes": [{"id": node} for node in nodes], "links": links})
 
+    return graphs
+
+
+def convert_plate_to_graphs_json(processed_path, plate, json_output_path):
+    matching_rows = load_processed_routes(processed_path, columns=['num_plate', 'route', 'times'], plate=plate)
+    graphs = build_plate_graphs(matching_rows)
+
     with open(json_output_path, 'w') as f:
         json.dump(graphs, f, indent=4)
 
 
+class ProcessedRoutesIndex:
+    def __init__(self, data: pd.DataFrame, graph_cache_size=GRAPH_CACHE_SIZE):
+        self.data = data.reset_index(drop=True)
+        self.plate_rows = self.data.groupby('num_plate', sort=False, observed=True).indices
+        self.graph_cache = LRUCache(graph_cache_size)
+        self.layout = None
+
+    @classmethod
+    def from_file(cls, path, graph_cache_size=GRAPH_CACHE_SIZE):
+        return cls(load_processed_routes(path), graph_cache_size)
+
+    def get_rows(self, plate):
+        positions = self.plate_rows.get(plate)
+        if positions is None:
+            return self.data.iloc[:0]
+        return self.data.iloc[positions]
+
+    def get_camera_layout(self):
+        # One layout for every camera in the processed network, shared by all plates.
+        if self.layout is None:
+            cameras = self.data['route'].explode().dropna().astype(str)
+            next_cameras = cameras.groupby(level=0).shift(-1)
+            has_next = next_cameras.notna()
+            edges = set(zip(cameras[has_next], next_cameras[has_next]))
+            self.layout = compute_camera_layout(set(cameras), edges)
+        return self.layout
+
+    def get_graphs(self, plate):
+        graphs = self.graph_cache.get(plate)
+        if graphs is None:
+            graphs = build_plate_graphs(self.get_rows(plate))
+            self.graph_cache.put(plate, graphs)
+        return graphs
+
+
+class RouteInsertions:
+    # Cameras of the user route that lie between two of its cameras, worked out on demand as a slice
+    # (forward or reverse) from a camera -> positions index. Behaves like the pair -> cameras mapping
+    # this replaces: when a camera repeats, the last occurrences win.
+    def __init__(self, route):
+        self.route = list(route)
+        self.positions = defaultdict(list)
+        for position, camera in enumerate(self.route):
+            self.positions[camera].append(position)
+
+    def get(self, key, default=None):
+        start_node, end_node = key
+        for i in reversed(self.positions.get(start_node, ())):
+            for j in reversed(self.positions.get(end_node, ())):
+                if i + 1 < j:
+                    return self.route[i + 1:j]
+                if i > j + 1:
+                    return self.route[i - 1:j:-1]
+        return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __getitem__(self, key):
+        intermediate_nodes = self.get(key)
+        if intermediate_nodes is None:
+            raise KeyError(key)
+        return intermediate_nodes
+
+
 def generate_insertions(route):
-    insertions = {}
-
-    for i, start_node in enumerate(route):
-        for j, end_node in enumerate(route):
-            if i < j:
-                intermediate_nodes = route[i + 1:j]
-                if intermediate_nodes:
-                    insertions[(start_node, end_node)] = intermediate_nodes
-            elif i > j:
-                intermediate_nodes = route[i - 1:j:-1]
-                if intermediate_nodes:
-                    insertions[(start_node, end_node)] = intermediate_nodes
-
-    return insertions
+    return RouteInsertions(route)
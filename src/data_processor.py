@@ -1,28 +1,368 @@
+import math
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+import numpy as np
 import pandas as pd
-from correctors import Corrector, LevenshteinCorrector, DamerauLevenshteinCorrector
-from route_calculators import RouteCalculator, SimpleRouteCalculator
+import pyarrow as pa
+import pyarrow.parquet as pq
+from tqdm import tqdm
+from correctors import Corrector, LevenshteinCorrector, DamerauLevenshteinCorrector, map_plates
+from route_calculators import RouteCalculator, SimpleRouteCalculator, CompactRouteCalculator
+from instrumentation import StageInstrumentation
+from input_cache import ParsedInputCache
+from plate_store import PlateStore
+
+DEFAULT_MEMORY_BUDGET_MB = 1024
+DEFAULT_SAMPLE_FRACTION = 0.01
+STREAMING_SAMPLE_ROWS = 10000
+# Route building holds several copies of a partition (detections, trips, adjusted trips).
+STREAMING_MEMORY_OVERHEAD = 4
+PARQUET_ROW_GROUP_SIZE = 64 * 1024
+DETECTION_COLUMNS = ['num_plate', 'date', 'camera_ID', 'direction']
+COMPACT_DETECTION_DTYPES = {'num_plate': 'category', 'camera_ID': 'category', 'direction': 'category'}
+ROUTE_PARTITIONS_PER_WORKER = 4
+
+
+def to_csv_compatible(data: pd.DataFrame) -> pd.DataFrame:
+    # Arrow list columns are written in the same "[a, b]" form as Python lists.
+    list_columns = [column for column in data.columns if isinstance(data[column].dtype, pd.ArrowDtype)
+                    and pa.types.is_list(data[column].dtype.pyarrow_dtype)]
+    return data.assign(**{column: pd.Series(data[column].tolist(), index=data.index, dtype=object)
+                          for column in list_columns})
+
+
+def to_arrow_table(data: pd.DataFrame) -> pa.Table:
+    # Without the pandas metadata: it records Arrow list columns as ArrowDtype strings, which pandas
+    # cannot parse back when reading. Arrow types alone restore lists, timestamps and categoricals.
+    return pa.Table.from_pandas(data, preserve_index=False).replace_schema_metadata(None)
+
+
+def decoded_type(arrow_type):
+    # The value type of dictionary types, also as the items of list types (e.g. compact routes).
+    if pa.types.is_dictionary(arrow_type):
+        return arrow_type.value_type
+    if pa.types.is_list(arrow_type) and pa.types.is_dictionary(arrow_type.value_type):
+        return pa.list_(arrow_type.value_field.with_type(arrow_type.value_type.value_type))
+    return arrow_type
+
+
+class ProcessedRoutesWriter:
+    # Writes trips to output_path one part at a time, as Parquet (.parquet), Arrow IPC (.arrow,
+    # .feather) or CSV (anything else). Every part is cast to the schema of the first. Categorical
+    # columns get 32-bit dictionary indices in Parquet, so later parts may have more categories, and
+    # dictionary columns (also dictionary-encoded route items) are decoded in Arrow IPC files, which
+    # allow only one dictionary per column.
+    def __init__(self, output_path):
+        self.output_path = output_path
+        self.extension = os.path.splitext(output_path)[1].lower()
+        self.schema = None
+        self.writer = None
+        self.written = False
+
+    def write(self, data: pd.DataFrame):
+        if self.extension in ('.parquet', '.arrow', '.feather'):
+            table = to_arrow_table(data)
+            if self.writer is None:
+                self.open(table.schema)
+            table = table.cast(self.schema)
+            if self.extension == '.parquet':
+                self.writer.write_table(table, row_group_size=PARQUET_ROW_GROUP_SIZE)
+            else:
+                self.writer.write_table(table)
+        else:
+            to_csv_compatible(data).to_csv(self.output_path, mode='a' if self.written else 'w', header=not self.written,
+                                           index=False)
+        self.written = True
+
+    def open(self, schema):
+        if self.extension == '.parquet':
+            self.schema = pa.schema([field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+                                     if pa.types.is_dictionary(field.type) else field for field in schema])
+            self.writer = pq.ParquetWriter(self.output_path, self.schema)
+        else:
+            self.schema = pa.schema([field.with_type(decoded_type(field.type)) for field in schema])
+            self.writer = pa.ipc.new_file(self.output_path, self.schema)
+
+    def close(self):
+        if not self.written:
+            self.write(pd.DataFrame([]))
+        if self.writer is not None:
+            self.writer.close()
+
+
+def to_arrow_ipc(data: pd.DataFrame) -> bytes:
+    sink = pa.BufferOutputStream()
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    with pa.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def from_arrow_ipc(buffer, arrow_lists=True) -> pd.DataFrame:
+    table = pa.ipc.open_stream(buffer).read_all()
+    data = table.to_pandas(types_mapper=lambda arrow_type: pd.ArrowDtype(arrow_type) if pa.types.is_list(arrow_type) else None)
+    return data if arrow_lists else to_csv_compatible(data)
+
+
+route_worker_state = {}
+
+
+def init_route_worker(route_calculator, MAX_TIME_BETWEEN_TRIPS, insertions):
+    route_worker_state['route_calculator'] = route_calculator
+    route_worker_state['MAX_TIME_BETWEEN_TRIPS'] = MAX_TIME_BETWEEN_TRIPS
+    route_worker_state['insertions'] = insertions
+
+
+def calculate_partition_routes(buffer):
+    # Detections arrive and trips leave as Arrow IPC streams: one buffer copy each way instead of
+    # pickling every Python object of the frame.
+    route_calculator = route_worker_state['route_calculator']
+    routes = route_calculator.calculate_routes(from_arrow_ipc(buffer), route_worker_state['MAX_TIME_BETWEEN_TRIPS'])
+    routes = route_calculator.adjust_routes(routes, route_worker_state['insertions'])
+    return to_arrow_ipc(routes)
+
 
 class DataProcessor:
-    def __init__(self, filepath, corrector: Corrector, route_calculator: RouteCalculator):
+    def __init__(self, filepath, corrector: Corrector, route_calculator: RouteCalculator,
+                 memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB, sample_fraction=DEFAULT_SAMPLE_FRACTION,
+                 instrumentation: StageInstrumentation = None, compact=False, date_format=None,
+                 input_cache: ParsedInputCache = None, plate_store: PlateStore = None, route_workers=1):
         self.filepath = filepath
         self.corrector = corrector
         self.route_calculator = route_calculator
+        self.memory_budget_mb = memory_budget_mb
+        self.sample_fraction = sample_fraction
+        self.instrumentation = instrumentation or StageInstrumentation()
+        self.compact = compact
+        self.date_format = date_format
+        self.input_cache = input_cache
+        self.plate_store = plate_store
+        self.route_workers = route_workers
+        self.route_executor = None
         self.data = None
 
     def load_and_prepare_data(self):
-        self.data = pd.read_csv(self.filepath)
-        self.data['date'] = pd.to_datetime(self.data['date'])
-        self.data = self.data.iloc[:int(len(self.data) * 0.01)]
-        self.data.sort_values(by=['num_plate', 'date'], inplace=True)
+        with self.instrumentation.stage('load_and_prepare_data') as metrics:
+            cache_key = None
+            if self.input_cache is not None:
+                cache_key = self.input_cache.get_key(self.filepath, compact=self.compact, date_format=self.date_format,
+                                                     sample_fraction=self.sample_fraction)
+                self.data = self.input_cache.load(cache_key)
+                metrics['cache_hit'] = self.data is not None
+                if self.data is not None:
+                    metrics['rows_out'] = len(self.data)
+                    return
+
+            self.data = self.read_detections(self.filepath)
+            self.data = self.data.iloc[:int(len(self.data) * self.sample_fraction)]
+            self.data.sort_values(by=['num_plate', 'date'], inplace=True)
+            if cache_key is not None:
+                metrics['cache_stored'] = self.input_cache.store(cache_key, self.data)
+            metrics['rows_out'] = len(self.data)
+
+    def read_detections(self, path):
+        if not self.compact:
+            data = pd.read_csv(path)
+            data['date'] = pd.to_datetime(data['date'], format=self.date_format)
+            return data
+
+        # Compact schema: only the needed columns, plates/cameras/directions as integer-coded
+        # categoricals (numeric camera IDs keep numeric categories) and second-resolution dates.
+        data = pd.read_csv(path, usecols=DETECTION_COLUMNS, dtype=COMPACT_DETECTION_DTYPES)
+        camera_ids = pd.to_numeric(data['camera_ID'].cat.categories, errors='coerce')
+        if not camera_ids.isna().any() and camera_ids.is_unique:
+            data['camera_ID'] = data['camera_ID'].cat.rename_categories(camera_ids.astype(np.int64))
+        data['date'] = pd.to_datetime(data['date'], format=self.date_format).astype('datetime64[s]')
+        return data
 
     def correct_num_plates_and_remove_hashes(self):
-        self.data = self.corrector.correct_num_plates(self.data)
+        with self.instrumentation.stage('correct_num_plates', rows_in=len(self.data)) as metrics:
+            self.data = self.correct_plates(self.data)
+            self.remove_invalid_plates()
+            if self.corrector.correction_map:
+                self.sort_corrected_plates()
+            if self.plate_store is not None and not self.data.empty:
+                self.plate_store.record(self.data, self.corrector)
+            metrics['plates_corrected'] = len(self.corrector.correction_map)
+            metrics['rows_out'] = len(self.data)
+
+    def correct_plates(self, data):
+        # With a plate store, plates from earlier runs are extra candidates and known misreads are memoized.
+        if self.plate_store is None:
+            return self.corrector.correct_num_plates(data)
+        return self.corrector.correct_num_plates(data, known_plates=self.plate_store.get_known_plates(),
+                                                 memo=self.plate_store.get_memo(self.corrector))
+
+    def sort_corrected_plates(self):
+        # Corrected reads join the reads of their plate: a stable re-sort puts each plate's reads back
+        # in date order (simultaneous reads keep their order from the sort before correction).
+        self.data = self.data.sort_values(by=['num_plate', 'date'], kind='stable')
+
+    def remove_invalid_plates(self):
         self.data = self.data[~self.data['num_plate'].str.lower().str.contains('[^a-z0-9]', regex=True)]
         self.data = self.data[~(self.data['num_plate'] == 'unknown') & (self.data['num_plate'].str.len() > 3)]
+        if isinstance(self.data['num_plate'].dtype, pd.CategoricalDtype):
+            self.data = self.data.assign(num_plate=self.data['num_plate'].cat.remove_unused_categories())
 
     def calculate_and_adjust_routes(self, MAX_TIME_BETWEEN_TRIPS, insertions):
-        self.data = self.route_calculator.calculate_routes(self.data, MAX_TIME_BETWEEN_TRIPS)
-        self.data = self.route_calculator.adjust_routes(self.data, insertions)
+        with self.instrumentation.stage('calculate_and_adjust_routes', rows_in=len(self.data)) as metrics:
+            if self.route_workers > 1 and not self.data.empty:
+                self.data = self.calculate_routes_in_parallel(MAX_TIME_BETWEEN_TRIPS, insertions)
+            else:
+                self.data = self.route_calculator.calculate_routes(self.data, MAX_TIME_BETWEEN_TRIPS)
+                self.data = self.route_calculator.adjust_routes(self.data, insertions)
+            metrics['trips'] = metrics['rows_out'] = len(self.data)
+
+    def calculate_routes_in_parallel(self, MAX_TIME_BETWEEN_TRIPS, insertions):
+        # Plates are independent, so detections are hash-partitioned by plate (keeping their order
+        # within each partition) and every partition is segmented and adjusted in its own process.
+        # The calculators emit trips grouped by plate in a stable sort, so a stable sort of the
+        # concatenated partitions by plate gives the same trips in the same order as one process.
+        detections = self.data[[column for column in DETECTION_COLUMNS if column in self.data.columns]]
+        num_partitions = self.route_workers * ROUTE_PARTITIONS_PER_WORKER
+        partition_ids = (pd.util.hash_pandas_object(detections['num_plate'], index=False) % num_partitions).to_numpy()
+        order = np.argsort(partition_ids, kind='stable')
+        boundaries = np.flatnonzero(np.diff(partition_ids[order])) + 1
+        try:
+            buffers = [to_arrow_ipc(detections.iloc[positions]) for positions in np.split(order, boundaries)]
+        except (pa.ArrowException, TypeError):
+            # Columns Arrow cannot type (e.g. camera IDs read as numbers and strings) stay in this process.
+            routes = self.route_calculator.calculate_routes(self.data, MAX_TIME_BETWEEN_TRIPS)
+            return self.route_calculator.adjust_routes(routes, insertions)
+
+        arrow_lists = isinstance(self.route_calculator, CompactRouteCalculator)
+        with self.shared_route_executor(MAX_TIME_BETWEEN_TRIPS, insertions):
+            partitions = [from_arrow_ipc(buffer, arrow_lists)
+                          for buffer in self.route_executor.map(calculate_partition_routes, buffers)]
+
+        partitions = [partition for partition in partitions if not partition.empty]
+        if not partitions:
+            return pd.DataFrame([])
+        routes = pd.concat(partitions, ignore_index=True)
+        return routes.sort_values(by='num_plate', kind='stable', ignore_index=True)
+
+    @contextmanager
+    def shared_route_executor(self, MAX_TIME_BETWEEN_TRIPS, insertions):
+        # Starts the route worker pool unless one is already running, so nested calls (every
+        # partition of a streaming run) reuse the pool of the outermost one.
+        if self.route_executor is not None or self.route_workers <= 1:
+            yield
+            return
+        with ProcessPoolExecutor(max_workers=self.route_workers, initializer=init_route_worker,
+                                 initargs=(self.route_calculator, MAX_TIME_BETWEEN_TRIPS, insertions)) as executor:
+            self.route_executor = executor
+            try:
+                yield
+            finally:
+                self.route_executor = None
 
     def verify_and_classify_visits(self):
-        self.data.sort_values(by=['num_plate', 'entry_date'], inplace=True)
+        with self.instrumentation.stage('verify_and_classify_visits', rows_in=len(self.data)) as metrics:
+            self.data.sort_values(by=['num_plate', 'entry_date'], inplace=True)
+            metrics['rows_out'] = len(self.data)
+
+    def save_processed_data(self, output_path):
+        # Parquet and Arrow IPC keep route/times/directions as list columns and dates as timestamps;
+        # rows are sorted by plate so Parquet row groups can be pruned by plate when reading.
+        with self.instrumentation.stage('save_processed_data', rows_in=len(self.data)):
+            writer = ProcessedRoutesWriter(output_path)
+            writer.write(self.data)
+            writer.close()
+
+    def process_streaming(self, MAX_TIME_BETWEEN_TRIPS, insertions, output_path=None):
+        # Processes the whole file (no row limit) with peak memory bounded by memory_budget_mb:
+        # plates are corrected once over the distinct plate values, detections are hash-partitioned
+        # by corrected plate into temporary runs, and each run goes through trip building alone.
+        # With output_path, every run's trips are written out (sorted by plate within the run) as
+        # soon as they are built, self.data only holds the last run and the number of trips is
+        # returned; otherwise self.data holds all trips.
+        chunk_rows, num_partitions = self.plan_streaming()
+        correction_map = self.build_correction_map(chunk_rows)
+        processed = []
+        newest_dates = []
+        num_trips = 0
+        writer = ProcessedRoutesWriter(output_path) if output_path is not None else None
+
+        with tempfile.TemporaryDirectory() as partition_dir, self.shared_route_executor(MAX_TIME_BETWEEN_TRIPS, insertions):
+            with self.instrumentation.stage('partition_by_plate') as metrics:
+                partition_paths = self.partition_by_plate(partition_dir, correction_map, chunk_rows, num_partitions)
+                metrics['partitions'] = len(partition_paths)
+            for partition_path in tqdm(partition_paths, desc="Processing Partitions"):
+                with self.instrumentation.stage('load_partition') as metrics:
+                    # The same steps as load_and_prepare_data and correct_num_plates_and_remove_hashes.
+                    self.data = self.read_detections(partition_path)
+                    self.data.sort_values(by=['num_plate', 'date'], inplace=True)
+                    if correction_map:
+                        self.data['num_plate'] = map_plates(self.data['num_plate'], correction_map)
+                    self.remove_invalid_plates()
+                    if correction_map:
+                        self.sort_corrected_plates()
+                    if self.plate_store is not None:
+                        self.plate_store.record_plates(self.data)
+                    metrics['rows_out'] = len(self.data)
+                if self.data.empty:
+                    continue
+                newest_dates.append(self.data['date'].max())
+                self.calculate_and_adjust_routes(MAX_TIME_BETWEEN_TRIPS, insertions)
+                self.verify_and_classify_visits()
+                num_trips += len(self.data)
+                if writer is None:
+                    processed.append(self.data)
+                else:
+                    with self.instrumentation.stage('save_processed_data', rows_in=len(self.data)):
+                        writer.write(self.data)
+
+        # The correction map covers the whole file, so it is recorded once, as of the file's newest detection.
+        if self.plate_store is not None:
+            self.plate_store.record_corrections(self.corrector, max(newest_dates) if newest_dates else pd.NaT)
+        if writer is not None:
+            writer.close()
+            return num_trips
+        self.data = pd.concat(processed, ignore_index=True) if processed else pd.DataFrame([])
+        if not self.data.empty:
+            self.verify_and_classify_visits()
+        return num_trips
+
+    def plan_streaming(self):
+        sample = pd.read_csv(self.filepath, nrows=STREAMING_SAMPLE_ROWS)
+        if sample.empty:
+            return STREAMING_SAMPLE_ROWS, 1
+        memory_row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+        file_row_bytes = len(sample.to_csv(index=False)) / len(sample)
+        estimated_rows = os.path.getsize(self.filepath) / file_row_bytes
+
+        budget_bytes = self.memory_budget_mb * 1024 * 1024
+        rows_per_budget = max(1, int(budget_bytes / (memory_row_bytes * STREAMING_MEMORY_OVERHEAD)))
+        num_partitions = max(1, math.ceil(estimated_rows / rows_per_budget))
+        return rows_per_budget, num_partitions
+
+    def build_correction_map(self, chunk_rows):
+        with self.instrumentation.stage('correct_num_plates') as metrics:
+            plates = set()
+            for chunk in pd.read_csv(self.filepath, usecols=['num_plate'], chunksize=chunk_rows):
+                plates.update(chunk['num_plate'].dropna())
+            plates = sorted(plates)
+
+            corrected = self.correct_plates(pd.DataFrame({'num_plate': plates}))
+            correction_map = {plate: corrected_plate for plate, corrected_plate in zip(plates, corrected['num_plate'])
+                              if plate != corrected_plate}
+            metrics['plates_corrected'] = len(correction_map)
+            return correction_map
+
+    def partition_by_plate(self, partition_dir, correction_map, chunk_rows, num_partitions):
+        partition_paths = [os.path.join(partition_dir, f'partition_{i}.csv') for i in range(num_partitions)]
+        written = set()
+
+        for chunk in pd.read_csv(self.filepath, chunksize=chunk_rows):
+            chunk = chunk.dropna(subset=['num_plate'])
+            # Partitioned by corrected plate, but written with the plates as read: corrections are
+            # applied after the partition is sorted, in the same order as the in-memory path.
+            corrected_plates = chunk['num_plate'].map(correction_map).fillna(chunk['num_plate'])
+            partition_ids = pd.util.hash_pandas_object(corrected_plates, index=False) % num_partitions
+            for partition_id, partition in chunk.groupby(partition_ids.to_numpy()):
+                partition.to_csv(partition_paths[partition_id], mode='a', header=partition_id not in written, index=False)
+                written.add(partition_id)
+
+        return [partition_paths[i] for i in sorted(written)]
@@ -1,14 +1,26 @@
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import threading
+import io
+import datetime
+import numpy as np
 from PIL import Image, ImageTk
-import pandas as pd
 
 from correctors import LevenshteinCorrector, DamerauLevenshteinCorrector
-from route_calculators import SimpleRouteCalculator
+from route_calculators import VectorizedRouteCalculator
 from data_processor import DataProcessor
-from data_gui_processing import generate_insertions, convert_plate_to_graphs_json
-from plotting import generate_and_save_plotly_graph
+from instrumentation import StageInstrumentation, CallbackSink
+from input_cache import ParsedInputCache
+from sweep import ThresholdSweep, parse_thresholds
+from jobs import JobExecutor
+from data_gui_processing import generate_insertions, ProcessedRoutesIndex
+from plotting import render_graph_image
+from analytics import render_network_image
+from trip_query import TripIndex, parse_query_time
+from caching import LRUCache
+from virtual_treeview import VirtualTreeview, SORT_COLUMNS
+
+GRAPH_IMAGE_CACHE_BYTES = 64 * 1024 * 1024
+PREFETCH_ROWS = 2
 
 
 class ProfessionalTkinterGUI(tk.Tk):
@@ -19,6 +31,13 @@ class ProfessionalTkinterGUI(tk.Tk):
         self.configure(bg='white')
 
         self.processed_file_path = None
+        self.routes_index = None
+        self.graph_image_cache = LRUCache(GRAPH_IMAGE_CACHE_BYTES, size_of=len)
+        self.input_cache = ParsedInputCache()
+        self.sweep = None
+        self.jobs = JobExecutor(self)
+        self.network_images = {}
+        self.trip_index = None
         self.distance_algorithm = tk.StringVar(value="levenshtein")
 
         self.style = ttk.Style(self)
@@ -29,6 +48,8 @@ class ProfessionalTkinterGUI(tk.Tk):
 
 
         self.normalize_data = tk.BooleanVar(value=False)
+        self.stream_data = tk.BooleanVar(value=False)
+        self.fast_rendering = tk.BooleanVar(value=False)
         self.create_notebook()
         self.create_widgets()
         self.create_treeview()
@@ -77,6 +98,12 @@ class ProfessionalTkinterGUI(tk.Tk):
         self.normalize_checkbutton = ttk.Checkbutton(self.distance_algorithm_frame, text="Normalize Plates", variable=self.normalize_data)
         self.normalize_checkbutton.pack(anchor='w', pady=2)
 
+        self.stream_checkbutton = ttk.Checkbutton(self.distance_algorithm_frame, text="Streaming Mode (full file)", variable=self.stream_data)
+        self.stream_checkbutton.pack(anchor='w', pady=2)
+
+        self.fast_rendering_checkbutton = ttk.Checkbutton(self.distance_algorithm_frame, text="Fast Graph Rendering", variable=self.fast_rendering)
+        self.fast_rendering_checkbutton.pack(anchor='w', pady=2)
+
         self.max_time_between_frame = tk.Frame(self.main_frame)
         self.max_time_between_frame.pack(pady=10, fill='x', expand=True)
         self.max_time_between_label = ttk.Label(self.max_time_between_frame, text="Max Time Between Trips (minutes):", anchor='w')
@@ -84,6 +111,11 @@ class ProfessionalTkinterGUI(tk.Tk):
         self.max_time_between_input = ttk.Entry(self.max_time_between_frame, width=20)
         self.max_time_between_input.pack(side='left', fill='x', padx=(0, 10))
         self.max_time_between_input.insert(0, "1440")
+        # Left empty, dates are inferred; a strftime format such as %Y-%m-%d %H:%M:%S parses faster.
+        self.date_format_label = ttk.Label(self.max_time_between_frame, text="Date Format (optional):", anchor='w')
+        self.date_format_label.pack(side='left', padx=(10, 10))
+        self.date_format_input = ttk.Entry(self.max_time_between_frame, width=20)
+        self.date_format_input.pack(side='left', fill='x', padx=(0, 10))
 
         self.route_input_frame = tk.Frame(self.algorithm_route_frame, width=button_width)
         self.route_input_frame.pack(side='right', padx=button_padx)
@@ -95,6 +127,14 @@ class ProfessionalTkinterGUI(tk.Tk):
         self.process_button_frame.pack(pady=5, fill='x', expand=True)
         self.process_button = ttk.Button(self.process_button_frame, text="Process Data", state='disabled', command=self.start_processing, width=button_width)
         self.process_button.pack(side='left', padx=button_padx)
+        self.sweep_button = ttk.Button(self.process_button_frame, text="Sweep Thresholds", state='disabled', command=self.start_sweep, width=button_width)
+        self.sweep_button.pack(side='left', padx=button_padx)
+        self.cancel_button = ttk.Button(self.process_button_frame, text="Cancel", state='disabled', command=self.cancel_processing)
+        self.cancel_button.pack(side='left', padx=(0, 10))
+        ttk.Label(self.process_button_frame, text="Thresholds (minutes):", font=('Helvetica', 10)).pack(side='left')
+        self.sweep_thresholds_input = ttk.Entry(self.process_button_frame, width=30)
+        self.sweep_thresholds_input.pack(side='left', padx=(5, 0))
+        self.sweep_thresholds_input.insert(0, "15, 30, 60, 120, 240, 480, 720, 1440")
 
         self.save_button_frame = tk.Frame(self.main_frame)
         self.save_button_frame.pack(pady=5, fill='x', expand=True)
@@ -119,23 +159,50 @@ class ProfessionalTkinterGUI(tk.Tk):
         self.tree_frame = ttk.Frame(self.graph_tab_frame)
         self.tree_frame.pack(side="left", fill="y", expand=False)
 
-        self.tree = ttk.Treeview(self.tree_frame)
-        self.tree.pack(side="left", fill="y")
-
-        self.scrollbar = ttk.Scrollbar(self.tree_frame, orient="vertical", command=self.tree.yview)
-        self.scrollbar.pack(side="right", fill="y")
-
-        self.tree.configure(yscrollcommand=self.scrollbar.set)
+        self.tree_controls_frame = ttk.Frame(self.tree_frame)
+        self.tree_controls_frame.pack(side="top", fill="x")
+        ttk.Label(self.tree_controls_frame, text="Plate:", font=('Helvetica', 10)).pack(side="left")
+        self.plate_filter_input = ttk.Entry(self.tree_controls_frame, width=15)
+        self.plate_filter_input.pack(side="left", padx=(0, 10))
+        self.plate_filter_input.bind('<Return>', lambda event: self.table.set_plate_filter(self.plate_filter_input.get()))
+        ttk.Label(self.tree_controls_frame, text="Sort by:", font=('Helvetica', 10)).pack(side="left")
+        self.sort_column_input = ttk.Combobox(self.tree_controls_frame, values=SORT_COLUMNS, state="readonly", width=12)
+        self.sort_column_input.pack(side="left")
+        self.sort_column_input.bind('<<ComboboxSelected>>', lambda event: self.table.sort_by(self.sort_column_input.get()))
+        self.network_button = ttk.Button(self.tree_controls_frame, text="Network", command=self.show_network_graph)
+        self.network_button.pack(side="left", padx=(10, 0))
+
+        self.query_frame = ttk.Frame(self.tree_frame)
+        self.query_frame.pack(side="top", fill="x", pady=(5, 0))
+        ttk.Label(self.query_frame, text="Camera (A or A>B):", font=('Helvetica', 10)).pack(side="left")
+        self.query_camera_input = ttk.Entry(self.query_frame, width=10)
+        self.query_camera_input.pack(side="left", padx=(0, 5))
+        ttk.Label(self.query_frame, text="From:", font=('Helvetica', 10)).pack(side="left")
+        self.query_start_input = ttk.Entry(self.query_frame, width=16)
+        self.query_start_input.pack(side="left", padx=(0, 5))
+        ttk.Label(self.query_frame, text="To:", font=('Helvetica', 10)).pack(side="left")
+        self.query_end_input = ttk.Entry(self.query_frame, width=16)
+        self.query_end_input.pack(side="left", padx=(0, 5))
+        ttk.Label(self.query_frame, text="Within (min):", font=('Helvetica', 10)).pack(side="left")
+        self.query_within_input = ttk.Entry(self.query_frame, width=5)
+        self.query_within_input.pack(side="left", padx=(0, 5))
+        self.query_within_input.insert(0, "10")
+        ttk.Button(self.query_frame, text="Query", command=self.run_trip_query).pack(side="left")
+        ttk.Button(self.query_frame, text="Clear", command=lambda: self.table.set_row_filter(None)).pack(side="left")
+
+        self.table = VirtualTreeview(self.tree_frame)
+        self.table.pack(side="top", fill="y", expand=True)
+        self.tree = self.table.tree
         self.tree.bind('<<TreeviewSelect>>', self.on_item_selected)
 
         self.graph_display_frame = ttk.Frame(self.graph_tab_frame)
         self.graph_display_frame.pack(side="right", fill="both", expand=True)
 
-    def display_graph_image(self, image_path):
+    def display_graph_image(self, image_bytes):
         if hasattr(self, 'graph_image_label'):
             self.graph_image_label.destroy()
 
-        graph_image = Image.open(image_path)
+        graph_image = Image.open(io.BytesIO(image_bytes))
         graph_image = graph_image.resize((800, 600), Image.Resampling.LANCZOS)
         graph_photo = ImageTk.PhotoImage(graph_image)
 
@@ -146,33 +213,100 @@ class ProfessionalTkinterGUI(tk.Tk):
     def on_item_selected(self, event):
         selected_items = self.tree.selection()
         if selected_items:
-            item = self.tree.item(selected_items[0])
-            plate = item['values'][0]
-            if self.processed_file_path:
-                convert_plate_to_graphs_json(self.processed_file_path, plate, 'graphs_data.json')
-                generate_and_save_plotly_graph('graphs_data.json', 'graph.png')
-                self.display_graph_image('graph.png')
+            plate = self.tree.set(selected_items[0], 'num_plate')
+            if self.routes_index is not None:
+                fast = self.fast_rendering.get()
+                image_bytes = self.graph_image_cache.get((plate, fast))
+                if image_bytes is not None:
+                    self.display_graph_image(image_bytes)
+                else:
+                    self.submit_render(plate, fast)
+                self.prefetch_neighbours(selected_items[0], plate, fast)
             else:
                 messagebox.showwarning("Warning", "No processed data file available. Please process and save data first.")
 
-    def load_data_into_treeview(self, filepath):
-        for i in self.tree.get_children():
-            self.tree.delete(i)
-
-        data = pd.read_csv(filepath)
-
-        self.tree["columns"] = list(data.columns)
-        self.tree["show"] = "headings"
-
-        for col in self.tree["columns"]:
-            self.tree.heading(col, text=col)
-            self.tree.column(col, width=100)
+    def submit_render(self, plate, fast):
+        routes_index = self.routes_index
+        self.jobs.submit(('render', plate, fast), lambda job: self.render_graph(job, routes_index, plate, fast),
+                         on_result=lambda image_bytes: self.show_rendered_graph(plate, fast, image_bytes))
+
+    def prefetch_neighbours(self, item, plate, fast):
+        plates = [neighbour for neighbour in self.table.get_neighbour_values(item, 'num_plate', PREFETCH_ROWS)
+                  if self.graph_image_cache.get((neighbour, fast)) is None]
+        wanted = {('render', neighbour, fast) for neighbour in plates} | {('render', plate, fast)}
+        self.jobs.cancel_where(lambda key: isinstance(key, tuple) and key[0] == 'render' and key not in wanted)
+        for neighbour in plates:
+            self.submit_render(neighbour, fast)
+
+    def render_graph(self, job, routes_index, plate, fast):
+        graphs = routes_index.get_graphs(plate)
+        job.check_cancelled()
+        if not graphs:
+            return None
+        return render_graph_image(graphs, routes_index.get_camera_layout(), fast=fast)
+
+    def show_rendered_graph(self, plate, fast, image_bytes):
+        if image_bytes is None:
+            return
+        self.graph_image_cache.put((plate, fast), image_bytes)
+        selected_items = self.tree.selection()
+        if selected_items and self.tree.set(selected_items[0], 'num_plate') == plate:
+            self.display_graph_image(image_bytes)
+
+    def show_network_graph(self):
+        if self.routes_index is None:
+            messagebox.showwarning("Warning", "No processed data file available. Please process and save data first.")
+            return
+        fast = self.fast_rendering.get()
+        if self.network_images.get(fast) is not None:
+            self.display_graph_image(self.network_images[fast])
+            return
+        routes_index = self.routes_index
+        self.status_label.config(text="Status: Building network flows...")
+        self.jobs.submit(('network', fast), lambda job: render_network_image(routes_index.data, routes_index.get_camera_layout(), fast),
+                         on_result=lambda image_bytes: self.show_network_image(fast, image_bytes), on_error=self.on_job_error)
+
+    def show_network_image(self, fast, image_bytes):
+        self.network_images[fast] = image_bytes
+        self.display_graph_image(image_bytes)
+        self.status_label.config(text="Status: Network flows ready")
+
+    def run_trip_query(self):
+        # "A" finds trips through camera A, "A>B" trips where the plate passes A and then B within
+        # the given minutes. From/To take dates ("2024-01-01 08:00") or times of day ("08:00").
+        if self.trip_index is None:
+            messagebox.showwarning("Warning", "No processed data file available. Please process and save data first.")
+            return
+        try:
+            cameras = [camera.strip() for camera in self.query_camera_input.get().split('>') if camera.strip()]
+            start = parse_query_time(self.query_start_input.get())
+            end = parse_query_time(self.query_end_input.get())
+            times_of_day = isinstance(start, datetime.time) or isinstance(end, datetime.time)
+            if len(cameras) == 2:
+                matches = self.trip_index.plates_through_sequence(cameras[0], cameras[1], float(self.query_within_input.get()))
+                positions = np.unique(matches['first_trip'].to_numpy())
+            elif times_of_day:
+                if len(cameras) != 1 or not (isinstance(start, datetime.time) and isinstance(end, datetime.time)):
+                    raise ValueError("Times of day need one camera and both From and To.")
+                positions = self.trip_index.trips_through_camera_at(cameras[0], start, end)
+            elif len(cameras) == 1:
+                positions = self.trip_index.trips_through_camera(cameras[0], start, end)
+            elif start is not None and end is not None:
+                positions = self.trip_index.trips_overlapping(start, end)
+            else:
+                raise ValueError("Enter a camera, or both From and To dates.")
+        except ValueError as error:
+            messagebox.showerror("Invalid Query", str(error))
+            return
+        self.table.set_row_filter(positions)
+        self.status_label.config(text=f"Status: {len(positions)} trips match the query")
 
-        for _, row in data.iterrows():
-            self.tree.insert("", "end", values=list(row))
+    def load_data_into_treeview(self, data):
+        self.table.set_data(data)
 
 
     def close_app(self):
+        self.jobs.shutdown()
         self.destroy()
 
 
@@ -183,60 +317,127 @@ class ProfessionalTkinterGUI(tk.Tk):
             self.selected_file_label.config(text=f"Selected File: {filepath.split('/')[-1]}")
             self.status_label.config(text="Status: File loaded")
             self.process_button['state'] = 'normal'
+            self.sweep_button['state'] = 'normal'
+            self.sweep = None
 
 
     def start_processing(self):
         self.status_label.config(text="Status: Processing data...")
         self.process_button['state'] = 'disabled'
         self.load_button['state'] = 'disabled'
-
-        if self.distance_algorithm.get() == "levenshtein":
-            corrector = LevenshteinCorrector(normalize=self.normalize_data.get())
-        elif self.distance_algorithm.get() == "damerau":
-            corrector = DamerauLevenshteinCorrector(normalize=self.normalize_data.get())
-        else:
-            corrector = None
+        self.cancel_button['state'] = 'normal'
 
         user_route_str = self.route_input.get()
         user_route_list = user_route_str.split(',')
         user_route_list = [node.strip() for node in user_route_list]
-        self.insertions = generate_insertions(user_route_list)
-        self.max_time_between_trips = int(self.max_time_between_input.get())
-        thread = threading.Thread(target=self.process_data)
-        thread.start()
-
-
-    def process_data(self):
-        try:
-            self.status_label.config(text="Status: Loading and preparing data...")
-            self.update()
-
-            if self.distance_algorithm.get() == "levenshtein":
-                corrector = LevenshteinCorrector()
-            elif self.distance_algorithm.get() == "damerau":
-                corrector = DamerauLevenshteinCorrector()
-            else:
-                corrector = None
-
-            route_calculator = SimpleRouteCalculator()
-            self.processor = DataProcessor(self.filepath, corrector, route_calculator)
-
-            self.processor.load_and_prepare_data()
-            self.status_label.config(text="Status: Correcting number plates...")
-            self.update()
-
-            self.processor.correct_num_plates_and_remove_hashes()
-
-            self.status_label.config(text="Status: Calculating and adjusting routes...")
-            self.update()
+        insertions = generate_insertions(user_route_list)
+        max_time_between_trips = int(self.max_time_between_input.get())
+        date_format = self.date_format_input.get().strip() or None
+        algorithm = self.distance_algorithm.get()
+        streaming = self.stream_data.get()
+        self.jobs.submit('process', lambda job: self.process_data(job, algorithm, max_time_between_trips, insertions,
+                                                                   date_format, streaming),
+                         on_result=self.on_processing_finished, on_progress=self.show_stage_event,
+                         on_error=self.on_job_error, on_cancelled=self.on_processing_cancelled)
+
+    def cancel_processing(self):
+        self.cancel_button['state'] = 'disabled'
+        self.status_label.config(text="Status: Cancelling after the current stage...")
+        self.jobs.cancel('process')
+        self.jobs.cancel('sweep')
+
+    def process_data(self, job, algorithm, max_time_between_trips, insertions, date_format, streaming):
+        if algorithm == "levenshtein":
+            corrector = LevenshteinCorrector()
+        elif algorithm == "damerau":
+            corrector = DamerauLevenshteinCorrector()
+        else:
+            corrector = None
 
-            self.processor.calculate_and_adjust_routes(self.max_time_between_trips, self.insertions)
-            self.processor.verify_and_classify_visits()
+        # Every stage boundary reports progress and is where a cancelled run stops.
+        route_calculator = VectorizedRouteCalculator()
+        instrumentation = StageInstrumentation(CallbackSink(job.report))
+        processor = DataProcessor(self.filepath, corrector, route_calculator, instrumentation=instrumentation,
+                                  date_format=date_format, input_cache=self.input_cache)
 
-            self.after(100, lambda: self.status_label.config(text="Status: Data processed"))
-            self.after(100, self.enable_save_button)
-        finally:
-            self.after(100, self.enable_load_button)
+        if streaming:
+            processor.process_streaming(max_time_between_trips, insertions)
+        else:
+            processor.load_and_prepare_data()
+            processor.correct_num_plates_and_remove_hashes()
+            processor.calculate_and_adjust_routes(max_time_between_trips, insertions)
+            processor.verify_and_classify_visits()
+        return processor
+
+    def on_processing_finished(self, processor):
+        self.processor = processor
+        self.status_label.config(text="Status: Data processed")
+        self.enable_save_button()
+        self.finish_job()
+
+    def on_processing_cancelled(self):
+        self.status_label.config(text="Status: Processing cancelled")
+        self.finish_job()
+
+    def on_job_error(self, error):
+        self.status_label.config(text="Status: Failed")
+        messagebox.showerror("Error", str(error))
+        self.finish_job()
+
+    def finish_job(self):
+        self.cancel_button['state'] = 'disabled'
+        self.process_button['state'] = 'normal'
+        self.sweep_button['state'] = 'normal'
+        self.enable_load_button()
+
+    def start_sweep(self):
+        thresholds = parse_thresholds(self.sweep_thresholds_input.get())
+        date_format = self.date_format_input.get().strip() or None
+        algorithm = self.distance_algorithm.get()
+        normalize = self.normalize_data.get()
+        # The sweep keeps the corrected plates of every (algorithm, normalize) it has run, so it is
+        # only rebuilt when the file or the date format changes.
+        if self.sweep is None or self.sweep.date_format != date_format:
+            self.sweep = ThresholdSweep(self.filepath, date_format=date_format, input_cache=self.input_cache)
+        self.sweep_button['state'] = 'disabled'
+        self.cancel_button['state'] = 'normal'
+        self.status_label.config(text="Status: Sweeping thresholds...")
+        self.jobs.submit('sweep', lambda job: self.run_sweep(job, thresholds, algorithm, normalize),
+                         on_result=self.show_sweep_results, on_progress=self.show_stage_event,
+                         on_error=self.on_job_error, on_cancelled=self.on_processing_cancelled)
+
+    def run_sweep(self, job, thresholds, algorithm, normalize):
+        self.sweep.instrumentation = StageInstrumentation(CallbackSink(job.report))
+        return self.sweep.run(thresholds, algorithm, normalize)
+
+    def show_sweep_results(self, summary):
+        window = tk.Toplevel(self)
+        window.title("Threshold Sweep")
+        columns = list(summary.columns)
+        tree = ttk.Treeview(window, columns=columns, show='headings')
+        for column in columns:
+            tree.heading(column, text=column.replace('_', ' '))
+            tree.column(column, width=110, anchor='e')
+        for row in summary.itertuples(index=False):
+            tree.insert('', 'end', values=[f"{value:.2f}" if isinstance(value, float) else value for value in row])
+        tree.pack(fill='both', expand=True)
+        self.status_label.config(text=f"Status: Swept {len(summary)} thresholds")
+        self.finish_job()
+
+    def show_stage_event(self, event):
+        stage = event['stage'].replace('_', ' ')
+        if event['event'] == 'stage_started':
+            rows = f" ({event['rows_in']} rows)" if event['rows_in'] is not None else ""
+            self.status_label.config(text=f"Status: Running {stage}{rows}...")
+        else:
+            details = [f"{event['wall_seconds']:.1f}s"]
+            if event.get('rows_out') is not None:
+                details.append(f"{event['rows_out']} rows out")
+            if event.get('plates_corrected') is not None:
+                details.append(f"{event['plates_corrected']} plates corrected")
+            if event.get('trips') is not None:
+                details.append(f"{event['trips']} trips")
+            self.status_label.config(text=f"Status: Finished {stage} ({', '.join(details)})")
 
     def enable_save_button(self):
         self.save_button['state'] = 'normal'
@@ -246,10 +447,32 @@ class ProfessionalTkinterGUI(tk.Tk):
 
 
     def save_data(self):
-        save_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV Files", "*.csv")])
+        save_path = filedialog.asksaveasfilename(defaultextension=".csv", filetypes=[("CSV Files", "*.csv"), ("Parquet Files", "*.parquet"), ("Arrow IPC Files", "*.arrow")])
         if save_path:
-            self.processor.data.to_csv(save_path, index=False)
-            self.processed_file_path = save_path
-            self.status_label.config(text="Status: Data saved successfully")
-            messagebox.showinfo("Save Successful", "The processed data has been saved successfully.")
-            self.load_data_into_treeview(save_path)
+            self.save_button['state'] = 'disabled'
+            self.status_label.config(text="Status: Saving data...")
+            processor = self.processor
+            self.jobs.submit('save', lambda job: self.write_processed_data(processor, save_path),
+                             on_result=lambda indexes: self.on_data_saved(save_path, indexes),
+                             on_error=self.on_save_error)
+
+    def write_processed_data(self, processor, save_path):
+        processor.save_processed_data(save_path)
+        routes_index = ProcessedRoutesIndex(processor.data)
+        return routes_index, TripIndex(routes_index.data)
+
+    def on_data_saved(self, save_path, indexes):
+        self.processed_file_path = save_path
+        self.routes_index, self.trip_index = indexes
+        self.jobs.cancel_where(lambda key: isinstance(key, tuple) and key[0] == 'render')
+        self.graph_image_cache.clear()
+        self.network_images = {}
+        self.enable_save_button()
+        self.status_label.config(text="Status: Data saved successfully")
+        messagebox.showinfo("Save Successful", "The processed data has been saved successfully.")
+        self.load_data_into_treeview(self.routes_index.data)
+
+    def on_save_error(self, error):
+        self.enable_save_button()
+        self.status_label.config(text="Status: Save failed")
+        messagebox.showerror("Error", str(error))
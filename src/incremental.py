@@ -0,0 +1,86 @@
+import os
+import pandas as pd
+
+from data_processor import DataProcessor
+from input_cache import ParsedInputCache
+from plate_store import PlateStore
+from route_calculators import VectorizedRouteCalculator
+
+OPEN_TRIPS_FILE = 'open_trip_detections.parquet'
+DETECTION_COLUMNS = ['num_plate', 'date', 'camera_ID', 'direction']
+
+
+class IncrementalProcessor(DataProcessor):
+    # Processes detection batches in arrival order. Between runs it persists, in state_dir, the
+    # detections of every trip that may still be extended, and the known clean plates and correction
+    # memo in plate_store (by default a PlateStore in state_dir), so a run only touches the new batch
+    # plus the open trips. A trip is closed once the newest detection seen is more than
+    # MAX_TIME_BETWEEN_TRIPS minutes after its last detection. Trips carried over are rebuilt from
+    # their detections, so they start like a plate's first trip.
+    def __init__(self, state_dir, corrector, route_calculator: VectorizedRouteCalculator = None, date_format=None,
+                 plate_store: PlateStore = None, input_cache: ParsedInputCache = None, route_workers=1):
+        super().__init__(None, corrector, route_calculator or VectorizedRouteCalculator(), sample_fraction=1.0,
+                         date_format=date_format, input_cache=input_cache,
+                         plate_store=plate_store or PlateStore(state_dir), route_workers=route_workers)
+        self.state_dir = state_dir
+        self.open_trip_detections = pd.DataFrame(columns=DETECTION_COLUMNS)
+        self.load_state()
+
+    def load_state(self):
+        open_trips_path = os.path.join(self.state_dir, OPEN_TRIPS_FILE)
+        if os.path.exists(open_trips_path):
+            self.open_trip_detections = pd.read_parquet(open_trips_path)
+
+    def save_state(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        self.open_trip_detections.to_parquet(os.path.join(self.state_dir, OPEN_TRIPS_FILE), index=False)
+        self.plate_store.save()
+
+    def process_batch(self, filepath, MAX_TIME_BETWEEN_TRIPS, insertions):
+        self.filepath = filepath
+        self.load_and_prepare_data()
+        self.correct_num_plates_and_remove_hashes()
+        if self.data.empty:
+            # Nothing new was seen, so no open trip can have ended: they all stay open.
+            self.data = pd.DataFrame([])
+            self.save_state()
+            return self.data
+
+        watermark = self.data['date'].max()
+        detections = self.data[DETECTION_COLUMNS]
+        if not self.open_trip_detections.empty:
+            detections = pd.concat([self.open_trip_detections, detections], ignore_index=True)
+        self.close_trips(detections, MAX_TIME_BETWEEN_TRIPS, insertions, watermark)
+        self.save_state()
+        return self.data
+
+    def flush(self, MAX_TIME_BETWEEN_TRIPS, insertions):
+        # Closes every open trip, e.g. at the end of a dataset.
+        self.close_trips(self.open_trip_detections, MAX_TIME_BETWEEN_TRIPS, insertions, watermark=None)
+        self.save_state()
+        return self.data
+
+    def close_trips(self, detections, MAX_TIME_BETWEEN_TRIPS, insertions, watermark):
+        detections = detections.sort_values(by=['num_plate', 'date'], kind='stable')
+        if detections.empty:
+            self.open_trip_detections = detections
+            self.data = pd.DataFrame([])
+            return
+
+        detections, _, _, trip_id = self.route_calculator.segment_trips(detections, MAX_TIME_BETWEEN_TRIPS)
+        trip_id = pd.Series(trip_id, index=detections.index)
+        if watermark is None:
+            is_open = pd.Series(False, index=detections.index)
+        else:
+            last_trip_id = trip_id.groupby(detections['num_plate']).transform('last')
+            last_date = detections['date'].groupby(detections['num_plate']).transform('last')
+            is_last_trip = trip_id == last_trip_id
+            is_open = is_last_trip & ((watermark - last_date).dt.total_seconds() / 60 <= MAX_TIME_BETWEEN_TRIPS)
+
+        self.open_trip_detections = detections[is_open].reset_index(drop=True)
+        self.data = detections[~is_open]
+        if self.data.empty:
+            self.data = pd.DataFrame([])
+            return
+        self.calculate_and_adjust_routes(MAX_TIME_BETWEEN_TRIPS, insertions)
+        self.verify_and_classify_visits()
@@ -0,0 +1,82 @@
+import contextlib
+import hashlib
+import json
+import os
+import pyarrow as pa
+import pyarrow.feather as feather
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.pathcleaner_cache')
+DEFAULT_CACHE_SIZE_MB = 2048
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file_contents(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ParsedInputCache:
+    # On-disk cache of parsed, typed and sorted detections as uncompressed Arrow IPC files, which are
+    # memory-mapped on a hit. Entries are keyed by the file's path, size, mtime and content hash plus
+    # the parse options; the least recently used entries are evicted above max_size_mb.
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_size_mb=DEFAULT_CACHE_SIZE_MB):
+        self.cache_dir = cache_dir
+        self.max_size_mb = max_size_mb
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get_key(self, path, **options):
+        stat = os.stat(path)
+        fingerprint = {
+            'path': os.path.abspath(path),
+            'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'content_hash': hash_file_contents(path),
+            'options': options,
+        }
+        return hashlib.blake2b(json.dumps(fingerprint, sort_keys=True, default=str).encode(), digest_size=16).hexdigest()
+
+    def get_entry_path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.arrow')
+
+    def load(self, key):
+        entry_path = self.get_entry_path(key)
+        if not os.path.exists(entry_path):
+            return None
+        os.utime(entry_path)
+        return feather.read_table(entry_path, memory_map=True).to_pandas()
+
+    def store(self, key, data):
+        # Returns whether the entry was written. Columns Arrow cannot type (read_csv can infer a column
+        # as numbers in one chunk and strings in another) are left uncached rather than failing the run.
+        entry_path = self.get_entry_path(key)
+        temporary_path = entry_path + '.tmp'
+        try:
+            feather.write_feather(data.reset_index(drop=True), temporary_path, compression='uncompressed')
+        except (pa.ArrowException, TypeError):
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(temporary_path)
+            return False
+        os.replace(temporary_path, entry_path)
+        self.evict()
+        return True
+
+    def evict(self):
+        # Several batch workers may share a cache directory, so entries can vanish while scanning.
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith('.arrow'):
+                with contextlib.suppress(FileNotFoundError):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        total_size = sum(size for _, size, _ in entries)
+        max_size = self.max_size_mb * 1024 * 1024
+        for _, size, path in entries:
+            if total_size <= max_size:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total_size -= size
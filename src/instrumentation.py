@@ -0,0 +1,85 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+import cProfile
+import json
+import sys
+import time
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then reported as None.
+    resource = None
+
+
+def get_peak_rss_mb():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+
+
+class MetricsSink(ABC):
+    @abstractmethod
+    def emit(self, event: dict):
+        pass
+
+class InMemorySink(MetricsSink):
+    def __init__(self):
+        self.events = []
+
+    def emit(self, event: dict):
+        self.events.append(event)
+
+class JsonLinesSink(MetricsSink):
+    def __init__(self, path):
+        self.path = path
+
+    def emit(self, event: dict):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(event, default=str) + '\n')
+
+class CallbackSink(MetricsSink):
+    def __init__(self, callback):
+        self.callback = callback
+
+    def emit(self, event: dict):
+        self.callback(event)
+
+
+class StageInstrumentation:
+    # Emits a 'stage_started' and a 'stage_finished' event per pipeline stage. Finished events carry
+    # wall and CPU time, the peak RSS delta and whatever the stage recorded (rows_out, trips, ...).
+    # The stage named profile_stage also runs under cProfile, with stats dumped to profile_output.
+    def __init__(self, sink: MetricsSink = None, profile_stage=None, profile_output=None, context=None):
+        self.sink = sink
+        self.profile_stage = profile_stage
+        self.profile_output = profile_output
+        self.context = context or {}
+
+    def emit(self, event):
+        if self.sink is not None:
+            self.sink.emit({**self.context, **event})
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        metrics = {'stage': name, 'rows_in': rows_in}
+        self.emit({'event': 'stage_started', 'stage': name, 'rows_in': rows_in})
+        profiler = cProfile.Profile() if name == self.profile_stage else None
+        start_rss_mb = get_peak_rss_mb()
+        start_wall, start_cpu = time.perf_counter(), time.process_time()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield metrics
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(self.profile_output or f'{name}.prof')
+            end_rss_mb = get_peak_rss_mb()
+            metrics.update({
+                'event': 'stage_finished',
+                'wall_seconds': time.perf_counter() - start_wall,
+                'cpu_seconds': time.process_time() - start_cpu,
+                'peak_rss_delta_mb': end_rss_mb - start_rss_mb if start_rss_mb is not None else None,
+            })
+            self.emit(metrics)
@@ -0,0 +1,119 @@
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+DEFAULT_WORKERS = 4
+POLL_INTERVAL_MS = 50
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    def __init__(self, key, function, executor, on_result=None, on_progress=None, on_error=None, on_cancelled=None):
+        self.key = key
+        self.function = function
+        self.executor = executor
+        self.on_result = on_result
+        self.on_progress = on_progress
+        self.on_error = on_error
+        self.on_cancelled = on_cancelled
+        self.cancel_event = threading.Event()
+        self.future = None
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+        # A job that never started is finished here; a running one stops at its next report.
+        if self.future is not None and self.future.cancel():
+            self.executor.messages.put(('cancelled', self, None))
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise JobCancelled(self.key)
+
+    def report(self, progress):
+        # Also the cancellation point: pipelines report at every stage boundary.
+        self.executor.messages.put(('progress', self, progress))
+        self.check_cancelled()
+
+    def run(self):
+        try:
+            self.check_cancelled()
+            result = self.function(self)
+            # Cancelled after its last report, the job ran on stale inputs: its result is dropped.
+            self.check_cancelled()
+        except JobCancelled:
+            self.executor.messages.put(('cancelled', self, None))
+        except Exception as error:
+            self.executor.messages.put(('error', self, error))
+        else:
+            self.executor.messages.put(('result', self, result))
+
+
+class JobExecutor:
+    # Runs jobs (functions taking their Job) on a thread pool. Workers never touch widgets: progress,
+    # results, errors and cancellations go through a queue that the Tk loop drains every
+    # poll_interval_ms, so all callbacks run on the Tk thread. Submitting a key that is already
+    # pending returns the pending job instead of running it twice.
+    def __init__(self, widget, max_workers=DEFAULT_WORKERS, poll_interval_ms=POLL_INTERVAL_MS):
+        self.widget = widget
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.messages = queue.Queue()
+        self.jobs = {}
+        self.poll_interval_ms = poll_interval_ms
+        self.poll_id = widget.after(poll_interval_ms, self.poll)
+
+    def submit(self, key, function, **callbacks):
+        job = self.jobs.get(key)
+        if job is not None and not job.cancelled:
+            return job
+        job = Job(key, function, self, **callbacks)
+        self.jobs[key] = job
+        job.future = self.pool.submit(job.run)
+        return job
+
+    def cancel(self, key):
+        job = self.jobs.get(key)
+        if job is not None:
+            job.cancel()
+
+    def cancel_where(self, predicate):
+        for key, job in list(self.jobs.items()):
+            if predicate(key):
+                job.cancel()
+
+    def is_pending(self, key):
+        return key in self.jobs
+
+    def poll(self):
+        while True:
+            try:
+                kind, job, payload = self.messages.get_nowait()
+            except queue.Empty:
+                break
+            # A job can be cancelled after posting; nothing but its cancellation is delivered then.
+            if job.cancelled and kind != 'cancelled':
+                if kind == 'progress':
+                    continue
+                kind, payload = 'cancelled', None
+            if kind != 'progress' and self.jobs.get(job.key) is job:
+                del self.jobs[job.key]
+            callback = getattr(job, f'on_{kind}')
+            if callback is None:
+                continue
+            if kind == 'cancelled':
+                callback()
+            else:
+                callback(payload)
+        self.poll_id = self.widget.after(self.poll_interval_ms, self.poll)
+
+    def shutdown(self):
+        for job in list(self.jobs.values()):
+            job.cancel()
+        self.widget.after_cancel(self.poll_id)
+        self.pool.shutdown(wait=False, cancel_futures=True)
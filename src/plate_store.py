@@ -0,0 +1,99 @@
+import os
+import pandas as pd
+
+KNOWN_PLATES_FILE = 'known_plates.parquet'
+CORRECTION_MEMO_FILE = 'correction_memo.parquet'
+DEFAULT_MAX_AGE_DAYS = 90
+PLATE_COLUMNS = ['num_plate', 'seen_count', 'last_seen']
+MEMO_COLUMNS = ['corrector', 'normalize', 'dirty_plate', 'corrected_plate', 'last_used']
+
+
+def memo_key(corrector):
+    return type(corrector).__name__, bool(corrector.normalize)
+
+
+def concat_non_empty(frames, columns):
+    frames = [frame for frame in frames if not frame.empty]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns)
+
+
+class PlateStore:
+    # Clean plates seen across runs (with how often and when they were last seen) and the memo of
+    # dirty -> corrected plates of every corrector/normalize pair, kept as parquet in store_dir.
+    # Known plates extend the correction candidates, most frequently seen first, and memoized
+    # misreads skip the search. Dates come from the detections: on save, plates not seen and memo
+    # entries not used within max_age_days of the newest detection age out.
+    def __init__(self, store_dir, max_age_days=DEFAULT_MAX_AGE_DAYS):
+        self.store_dir = store_dir
+        self.max_age_days = max_age_days
+        self.plates = pd.DataFrame(columns=PLATE_COLUMNS)
+        self.memo = pd.DataFrame(columns=MEMO_COLUMNS)
+        self.updates = []
+        self.load()
+
+    def load(self):
+        plates_path = os.path.join(self.store_dir, KNOWN_PLATES_FILE)
+        memo_path = os.path.join(self.store_dir, CORRECTION_MEMO_FILE)
+        if os.path.exists(plates_path):
+            self.plates = pd.read_parquet(plates_path)
+        if os.path.exists(memo_path):
+            self.memo = pd.read_parquet(memo_path)
+
+    def save(self):
+        self.age_out()
+        os.makedirs(self.store_dir, exist_ok=True)
+        self.plates.to_parquet(os.path.join(self.store_dir, KNOWN_PLATES_FILE), index=False)
+        self.memo.to_parquet(os.path.join(self.store_dir, CORRECTION_MEMO_FILE), index=False)
+        self.updates = []
+
+    def get_known_plates(self):
+        plates = self.plates.sort_values(['seen_count', 'last_seen'], ascending=False, kind='stable')
+        return plates['num_plate'].tolist()
+
+    def get_memo(self, corrector):
+        name, normalize = memo_key(corrector)
+        entries = self.memo[(self.memo['corrector'] == name) & (self.memo['normalize'] == normalize)]
+        return dict(zip(entries['dirty_plate'], entries['corrected_plate']))
+
+    def record(self, data: pd.DataFrame, corrector):
+        # Records the clean plates of corrected detections and the corrections that produced them.
+        self.record_plates(data)
+        self.record_corrections(corrector, data['date'].max() if len(data) else pd.NaT)
+
+    def record_plates(self, data: pd.DataFrame):
+        plates = data.assign(num_plate=data['num_plate'].astype(str)).groupby('num_plate')['date'].agg(
+            seen_count='size', last_seen='max').reset_index()
+        self.add_updates(plates, pd.DataFrame(columns=MEMO_COLUMNS))
+
+    def record_corrections(self, corrector, last_used):
+        # The corrector's correction_map, stamped with the newest detection it was used for.
+        name, normalize = memo_key(corrector)
+        memo = pd.DataFrame({
+            'corrector': name,
+            'normalize': normalize,
+            'dirty_plate': list(corrector.correction_map.keys()),
+            'corrected_plate': list(corrector.correction_map.values()),
+            'last_used': last_used,
+        }, columns=MEMO_COLUMNS)
+        self.add_updates(pd.DataFrame(columns=PLATE_COLUMNS), memo)
+
+    def add_updates(self, plates, memo):
+        self.apply_updates(plates, memo)
+        self.updates.append((plates, memo))
+
+    def apply_updates(self, plates, memo):
+        if not plates.empty:
+            plates = concat_non_empty([self.plates, plates], PLATE_COLUMNS)
+            self.plates = plates.groupby('num_plate').agg(seen_count=('seen_count', 'sum'),
+                                                          last_seen=('last_seen', 'max')).reset_index()
+        if not memo.empty:
+            memo = concat_non_empty([self.memo, memo], MEMO_COLUMNS)
+            self.memo = memo.drop_duplicates(['corrector', 'normalize', 'dirty_plate'], keep='last').reset_index(drop=True)
+
+    def age_out(self):
+        if self.plates.empty:
+            return
+        cutoff = pd.to_datetime(self.plates['last_seen']).max() - pd.Timedelta(days=self.max_age_days)
+        self.plates = self.plates[pd.to_datetime(self.plates['last_seen']) >= cutoff].reset_index(drop=True)
+        self.memo = self.memo[(pd.to_datetime(self.memo['last_used']) >= cutoff)
+                              & self.memo['corrected_plate'].isin(self.plates['num_plate'])].reset_index(drop=True)
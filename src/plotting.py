@@ -1,42 +1,91 @@
+import io
 import plotly.graph_objects as go
 import plotly.io as pio
 import json
 import networkx as nx
+import numpy as np
+from PIL import Image, ImageDraw
 
+from caching import LRUCache
+
+LAYOUT_CACHE_SIZE = 32
+LAYOUT_SEED = 0
+RASTER_SIZE = (800, 600)
+RASTER_MARGIN = 40
+NODE_RADIUS = 6
+TRIP_COLORS = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2', '#7f7f7f', '#bcbd22', '#17becf']
+
+camera_layout_cache = LRUCache(LAYOUT_CACHE_SIZE)
+
+
+def compute_camera_layout(cameras, edges):
+    # Layouts are seeded and cached per camera set, so a camera keeps its position across plates.
+    key = frozenset(cameras)
+    layout = camera_layout_cache.get(key)
+    if layout is None:
+        G = nx.Graph()
+        G.add_nodes_from(sorted(key))
+        G.add_edges_from(sorted(edges))
+        layout = nx.spring_layout(G, k=0.5, iterations=50, seed=LAYOUT_SEED)
+        camera_layout_cache.put(key, layout)
+    return layout
+
+
+def layout_for_graphs(graphs):
+    cameras = {node['id'] for graph_data in graphs for node in graph_data['nodes']}
+    edges = {(link['source'], link['target']) for graph_data in graphs for link in graph_data['links']}
+    return compute_camera_layout(cameras, edges)
+
+
+def trip_edge_coordinates(graph_data, layout):
+    links = graph_data['links']
+    x = np.full(3 * len(links), np.nan)
+    y = np.full(3 * len(links), np.nan)
+    for i, link in enumerate(links):
+        x[3 * i], y[3 * i] = layout[link['source']]
+        x[3 * i + 1], y[3 * i + 1] = layout[link['target']]
+    return x, y
 
 
 def generate_and_save_plotly_graph(json_output_path, image_output_path):
     with open(json_output_path) as f:
         graphs = json.load(f)
 
-    graph_data = graphs[0]
-    G = nx.Graph()
-    for node in graph_data['nodes']:
-        G.add_node(node['id'])
-
-    for link in graph_data['links']:
-        G.add_edge(link['source'], link['target'], weight=link['time'])
-
-    pos = nx.spring_layout(G, k=0.5, iterations=50)
-
-    edge_trace = go.Scatter(
-        x=[],
-        y=[],
-        line=dict(width=2, color='#888'),
-        hoverinfo='none',
-        mode='lines'
-    )
-
-    for edge in G.edges():
-        x0, y0 = pos[edge[0]]
-        x1, y1 = pos[edge[1]]
-        edge_trace['x'] += tuple([x0, x1, None])
-        edge_trace['y'] += tuple([y0, y1, None])
-
-    node_trace = go.Scatter(
-        x=[],
-        y=[],
-        text=[],
+    build_plotly_figure(graphs).write_image(image_output_path)
+
+
+def render_graph_image(graphs, layout=None, fast=False):
+    if fast:
+        return rasterize_graph_image(graphs, layout)
+    return render_plotly_graph_image(graphs, layout)
+
+
+def render_plotly_graph_image(graphs, layout=None, image_format='png'):
+    return build_plotly_figure(graphs, layout).to_image(format=image_format)
+
+
+def build_plotly_figure(graphs, layout=None):
+    if layout is None:
+        layout = layout_for_graphs(graphs)
+
+    traces = []
+    for trip_number, graph_data in enumerate(graphs):
+        x, y = trip_edge_coordinates(graph_data, layout)
+        traces.append(go.Scatter(
+            x=x,
+            y=y,
+            line=dict(width=graph_data.get('width', 2), color=TRIP_COLORS[trip_number % len(TRIP_COLORS)]),
+            hoverinfo='none',
+            mode='lines',
+            name=f'Trip {trip_number + 1}'
+        ))
+
+    nodes = sorted({node['id'] for graph_data in graphs for node in graph_data['nodes']})
+    node_positions = np.array([layout[node] for node in nodes]).reshape(-1, 2)
+    traces.append(go.Scatter(
+        x=node_positions[:, 0],
+        y=node_positions[:, 1],
+        text=nodes,
         mode='markers+text',
         hoverinfo='text',
         marker=dict(
@@ -46,17 +95,11 @@ def generate_and_save_plotly_graph(json_output_path, image_output_path):
             color=[],
             line=dict(width=2)
         )
-    )
-    for node in G.nodes():
-        x, y = pos[node]
-        node_trace['x'] += tuple([x])
-        node_trace['y'] += tuple([y])
-        node_trace['text'] += tuple([node])
-
-    fig = go.Figure(data=[edge_trace, node_trace],
+    ))
+
+    fig = go.Figure(data=traces,
                     layout=go.Layout(
-                        title='<br>Graph Visualization',
-                        titlefont=dict(size=16),
+                        title=dict(text='<br>Graph Visualization', font=dict(size=16)),
                         showlegend=False,
                         hovermode='closest',
                         margin=dict(b=20,l=5,r=5,t=40),
@@ -67,4 +110,44 @@ def generate_and_save_plotly_graph(json_output_path, image_output_path):
                         xaxis=dict(showgrid=False, zeroline=False, showticklabels=False),
                         yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
                     )
-    fig.write_image(image_output_path)
+    return fig
+
+
+def rasterize_graph_image(graphs, layout=None, size=RASTER_SIZE):
+    # Lightweight PIL renderer for interactive use; avoids the Plotly static-image export.
+    if layout is None:
+        layout = layout_for_graphs(graphs)
+
+    nodes = sorted({node['id'] for graph_data in graphs for node in graph_data['nodes']})
+    width, height = size
+    image = Image.new('RGB', size, 'white')
+    draw = ImageDraw.Draw(image)
+    if not nodes:
+        return image_to_png(image)
+
+    node_positions = np.array([layout[node] for node in nodes], dtype=float)
+    minimum, span = node_positions.min(axis=0), np.ptp(node_positions, axis=0)
+    span[span == 0] = 1
+    scale = np.array([width - 2 * RASTER_MARGIN, height - 2 * RASTER_MARGIN]) / span
+
+    def to_pixels(position):
+        x, y = (np.asarray(position) - minimum) * scale + RASTER_MARGIN
+        return x, height - y
+
+    for trip_number, graph_data in enumerate(graphs):
+        color = TRIP_COLORS[trip_number % len(TRIP_COLORS)]
+        for link in graph_data['links']:
+            draw.line([to_pixels(layout[link['source']]), to_pixels(layout[link['target']])], fill=color, width=graph_data.get('width', 2))
+
+    for node, position in zip(nodes, node_positions):
+        x, y = to_pixels(position)
+        draw.ellipse([x - NODE_RADIUS, y - NODE_RADIUS, x + NODE_RADIUS, y + NODE_RADIUS], fill='#41b6c4', outline='#253494', width=2)
+        draw.text((x + NODE_RADIUS + 2, y - NODE_RADIUS), node, fill='black')
+
+    return image_to_png(image)
+
+
+def image_to_png(image):
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
@@ -1,5 +1,8 @@
 from abc import ABC, abstractmethod
+from itertools import chain
+import numpy as np
 import pandas as pd
+import pyarrow as pa
 from tqdm import tqdm
 
 
@@ -77,3 +80,193 @@ class SimpleRouteCalculator(RouteCalculator):
             })
 
         return pd.DataFrame(refined_routes)
+
+
+class VectorizedRouteCalculator(SimpleRouteCalculator):
+    def calculate_routes(self, data: pd.DataFrame, MAX_TIME_BETWEEN_TRIPS: int) -> pd.DataFrame:
+        if data.empty:
+            return pd.DataFrame([])
+
+        data, time_diff, trip_break, trip_id = self.segment_trips(data, MAX_TIME_BETWEEN_TRIPS)
+
+        # A detection that opens a new trip after a gap is recorded twice in that trip's route
+        # and directions, and the gap that closed the previous trip becomes its first time.
+        positions = np.repeat(np.arange(len(data)), 1 + trip_break)
+        detections = pd.DataFrame({
+            'trip_id': trip_id[positions],
+            'num_plate': data['num_plate'].to_numpy()[positions],
+            'camera_ID': data['camera_ID'].to_numpy()[positions],
+            'date': data['date'].to_numpy()[positions],
+            'direction': data['direction'].to_numpy()[positions],
+            'times': time_diff.to_numpy()[positions],
+        })
+
+        routes = detections.groupby('trip_id', sort=False).agg(
+            num_plate=('num_plate', 'first'),
+            route=('camera_ID', list),
+            times=('times', list),
+            entry_date=('date', 'first'),
+            exit_date=('date', 'last'),
+            directions=('direction', list),
+        )
+        routes['times'] = routes['times'].str[1:]
+
+        return routes.reset_index(drop=True)
+
+    def adjust_routes(self, data: pd.DataFrame, insertions) -> pd.DataFrame:
+        if data.empty:
+            return pd.DataFrame([])
+
+        cameras, route_lengths = self.flatten_list_column(data['route'], dtype=object)
+        if 'times' in data.columns:
+            flat_times, times_lengths = self.flatten_list_column(data['times'], dtype=np.float64)
+        else:
+            flat_times, times_lengths = np.empty(0), np.zeros(len(data), dtype=np.int64)
+
+        # One entry per camera of every trip; every camera but a trip's first closes a hop.
+        trip_starts = np.cumsum(route_lengths) - route_lengths
+        trip_of_camera = np.repeat(np.arange(len(data)), route_lengths)
+        hop_number = np.arange(len(cameras)) - trip_starts[trip_of_camera]
+        is_hop = hop_number > 0
+
+        hop_time_index = (np.cumsum(times_lengths) - times_lengths)[trip_of_camera] + hop_number - 1
+        has_time = is_hop & (hop_number - 1 < times_lengths[trip_of_camera])
+        hop_times = np.zeros(len(cameras))
+        hop_times[has_time] = flat_times[hop_time_index[has_time]]
+
+        # A hop emits the cameras inserted between its endpoints, or its own camera when there are none,
+        # and splits its time evenly into len(inserted) + 1 parts; both only depend on the camera pair.
+        previous_cameras = np.empty(len(cameras), dtype=object)
+        previous_cameras[1:] = cameras[:-1]
+        pair_codes, pairs = pd.factorize(pd.MultiIndex.from_arrays([previous_cameras[is_hop], cameras[is_hop]]))
+        segments = [insertions[pair] if pair in insertions else [pair[1]] for pair in pairs]
+        inserted_counts = np.array([len(insertions[pair]) if pair in insertions else 0 for pair in pairs], dtype=np.int64)
+
+        segment_values = np.fromiter(chain.from_iterable(segments), dtype=object,
+                                     count=sum(map(len, segments))) if segments else np.empty(0, dtype=object)
+        segment_lengths = np.fromiter(map(len, segments), dtype=np.int64, count=len(segments))
+        segment_starts = np.cumsum(segment_lengths) - segment_lengths
+
+        output_starts = np.arange(len(cameras)) + len(segment_values)
+        output_lengths = np.ones(len(cameras), dtype=np.int64)
+        output_starts[is_hop] = segment_starts[pair_codes]
+        output_lengths[is_hop] = segment_lengths[pair_codes]
+        refined_cameras = np.concatenate([segment_values, cameras])[ragged_positions(output_starts, output_lengths)]
+
+        time_parts = np.zeros(len(cameras), dtype=np.int64)
+        time_parts[is_hop] = inserted_counts[pair_codes] + 1
+        refined_times = np.repeat(hop_times / np.maximum(time_parts, 1), time_parts)
+
+        refined_route_lengths = np.bincount(trip_of_camera, weights=output_lengths, minlength=len(data)).astype(np.int64)
+        refined_times_lengths = np.bincount(trip_of_camera, weights=time_parts, minlength=len(data)).astype(np.int64)
+
+        return pd.DataFrame({
+            'num_plate': data['num_plate'].array,
+            'route': self.build_list_column(refined_cameras, refined_route_lengths),
+            'times': self.build_list_column(refined_times, refined_times_lengths),
+            'entry_date': data['entry_date'].array,
+            'exit_date': data['exit_date'].array,
+        })
+
+    def flatten_list_column(self, column: pd.Series, dtype):
+        lists = column.tolist()
+        lengths = np.fromiter(map(len, lists), dtype=np.int64, count=len(lists))
+        values = np.fromiter(chain.from_iterable(lists), dtype=dtype, count=lengths.sum())
+        return values, lengths
+
+    def build_list_column(self, values, lengths):
+        return [values_of_trip.tolist() for values_of_trip in np.split(values, np.cumsum(lengths)[:-1])]
+
+    def segment_trips(self, data: pd.DataFrame, MAX_TIME_BETWEEN_TRIPS: int):
+        data = data.sort_values(by='num_plate', kind='stable')
+        time_diff = data.groupby('num_plate', observed=True)['date'].diff().dt.total_seconds() / 60
+        new_plate = data['num_plate'].ne(data['num_plate'].shift()).to_numpy()
+        trip_break = (time_diff > MAX_TIME_BETWEEN_TRIPS).to_numpy()
+        trip_id = np.cumsum(new_plate | trip_break)
+        return data, time_diff, trip_break, trip_id
+
+
+class CompactRouteCalculator(VectorizedRouteCalculator):
+    # Same trips as VectorizedRouteCalculator, but route, times and directions are Arrow list columns
+    # (one offsets array plus one values array per column: int32 camera IDs when they are numeric and
+    # dictionary-encoded ones otherwise, float32 minutes) instead of one Python list per trip.
+    def calculate_routes(self, data: pd.DataFrame, MAX_TIME_BETWEEN_TRIPS: int) -> pd.DataFrame:
+        if data.empty:
+            return pd.DataFrame([])
+
+        data, time_diff, trip_break, trip_id = self.segment_trips(data, MAX_TIME_BETWEEN_TRIPS)
+
+        positions = np.repeat(np.arange(len(data)), 1 + trip_break)
+        route_lengths = np.bincount(trip_id[positions] - 1)
+        route_offsets = np.concatenate([[0], np.cumsum(route_lengths)])
+        first_positions = positions[route_offsets[:-1]]
+        last_positions = positions[route_offsets[1:] - 1]
+
+        # The first entry of every trip carries no time (see VectorizedRouteCalculator).
+        has_time = np.ones(len(positions), dtype=bool)
+        has_time[route_offsets[:-1]] = False
+        gaps = time_diff.to_numpy(dtype=np.float32)[positions][has_time]
+
+        return pd.DataFrame({
+            'num_plate': data['num_plate'].array[first_positions],
+            'route': arrow_list_column(arrow_values(data['camera_ID'], positions), route_lengths),
+            'times': arrow_list_column(pa.array(gaps, type=pa.float32()), route_lengths - 1),
+            'entry_date': data['date'].array[first_positions],
+            'exit_date': data['date'].array[last_positions],
+            'directions': arrow_list_column(arrow_values(data['direction'], positions), route_lengths),
+        })
+
+    def flatten_list_column(self, column: pd.Series, dtype):
+        if not isinstance(column.dtype, pd.ArrowDtype):
+            return super().flatten_list_column(column, dtype)
+        lists = pa.array(column.array)
+        if isinstance(lists, pa.ChunkedArray):
+            lists = lists.combine_chunks()
+        values = lists.flatten().to_numpy(zero_copy_only=False)
+        return values.astype(dtype) if dtype is not object else values, lists.value_lengths().to_numpy()
+
+    def build_list_column(self, values, lengths):
+        array = pa.array(values)
+        if pa.types.is_integer(array.type):
+            array = array.cast(pa.int32())
+        elif pa.types.is_floating(array.type):
+            array = array.cast(pa.float32())
+        elif pa.types.is_string(array.type):
+            array = array.dictionary_encode()
+        return arrow_list_column(array, lengths)
+
+
+def arrow_values(column: pd.Series, positions):
+    # Numeric values are stored as int32. Other values (e.g. camera IDs like "C12") are dictionary-encoded:
+    # an int32 code per entry, the category codes of categorical columns, and every distinct value once.
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes, categories = column.cat.codes.to_numpy(), column.cat.categories.to_numpy()
+    elif pd.api.types.is_numeric_dtype(column.dtype):
+        values = pa.array(column.to_numpy()[positions])
+        return values.cast(pa.int32()) if pa.types.is_integer(values.type) else values
+    else:
+        codes, categories = pd.factorize(column.to_numpy())
+    dictionary = pa.array(categories)
+    codes = codes[positions]
+    if pa.types.is_integer(dictionary.type):
+        return dictionary.take(pa.array(codes, mask=codes < 0)).cast(pa.int32())
+    return pa.DictionaryArray.from_arrays(pa.array(codes.astype(np.int32), mask=codes < 0), dictionary)
+
+
+def arrow_list_column(values, lengths):
+    offsets = pa.array(np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32))
+    list_array = pa.ListArray.from_arrays(offsets, values)
+    return pd.arrays.ArrowExtensionArray(list_array)
+
+
+def ragged_positions(starts, lengths):
+    # Concatenation of range(start, start + length) for every start/length pair.
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(starts - offsets, lengths) + np.arange(lengths.sum())
+
+
+ROUTE_CALCULATORS = {
+    'simple': SimpleRouteCalculator,
+    'vectorized': VectorizedRouteCalculator,
+    'compact': CompactRouteCalculator,
+}
@@ -0,0 +1,112 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+from correctors import CORRECTORS
+from data_processor import DataProcessor, DEFAULT_SAMPLE_FRACTION
+from instrumentation import StageInstrumentation
+
+DURATION_QUANTILES = [0.1, 0.25, 0.5, 0.75, 0.9, 0.99]
+
+
+class ThresholdSweep:
+    # Evaluates many MAX_TIME_BETWEEN_TRIPS values over one file. Plate correction does not depend on
+    # the threshold, so it runs once per (algorithm, normalize) and is cached together with the
+    # inter-read gaps sorted in descending order. The breaks of a threshold are then a prefix of that
+    # order, and each threshold only costs a sort of its break positions plus a pass over its trips.
+    # Trips follow the route calculators: a break starts a new trip at the breaking read, the route of
+    # every trip after the first repeats its first camera, and a trip lasts from its first to its last read.
+    def __init__(self, filepath, sample_fraction=DEFAULT_SAMPLE_FRACTION, date_format=None, input_cache=None,
+                 instrumentation: StageInstrumentation = None):
+        self.filepath = filepath
+        self.sample_fraction = sample_fraction
+        self.date_format = date_format
+        self.input_cache = input_cache
+        self.instrumentation = instrumentation or StageInstrumentation()
+        self.gap_cache = {}
+
+    def get_gaps(self, algorithm, normalize):
+        key = (algorithm, normalize)
+        if key not in self.gap_cache:
+            processor = DataProcessor(self.filepath, CORRECTORS[algorithm](normalize=normalize), None,
+                                      sample_fraction=self.sample_fraction, instrumentation=self.instrumentation,
+                                      date_format=self.date_format, input_cache=self.input_cache)
+            processor.load_and_prepare_data()
+            processor.correct_num_plates_and_remove_hashes()
+            self.gap_cache[key] = self.build_gaps(processor.data)
+        return self.gap_cache[key]
+
+    def build_gaps(self, data: pd.DataFrame):
+        with self.instrumentation.stage('build_gaps', rows_in=len(data)):
+            # Same read order as VectorizedRouteCalculator.segment_trips.
+            data = data.sort_values(by='num_plate', kind='stable')
+            plate_starts = np.flatnonzero(data['num_plate'].ne(data['num_plate'].shift()).to_numpy())
+            minutes = (data['date'] - data['date'].min()).dt.total_seconds().to_numpy() / 60 if len(data) else np.empty(0)
+            gaps = np.diff(minutes, prepend=np.nan)
+            gaps[plate_starts] = np.nan
+
+            gap_positions = np.flatnonzero(~np.isnan(gaps))
+            order = np.argsort(-gaps[gap_positions], kind='stable')
+            return {
+                'minutes': minutes,
+                'plate_starts': plate_starts,
+                'sorted_gaps': gaps[gap_positions][order],
+                'sorted_gap_positions': gap_positions[order],
+            }
+
+    def run(self, thresholds, algorithm='levenshtein', normalize=False) -> pd.DataFrame:
+        gaps = self.get_gaps(algorithm, normalize)
+        with self.instrumentation.stage('sweep_thresholds', rows_in=len(gaps['minutes'])) as metrics:
+            summaries = [self.summarize_threshold(gaps, threshold) for threshold in sorted(thresholds)]
+            metrics['thresholds'] = len(summaries)
+        return pd.DataFrame(summaries)
+
+    def summarize_threshold(self, gaps, threshold):
+        minutes, plate_starts = gaps['minutes'], gaps['plate_starts']
+        # sorted_gaps is descending, so the gaps above the threshold are its first num_breaks entries.
+        num_breaks = int(np.searchsorted(-gaps['sorted_gaps'], -threshold, side='left'))
+        break_positions = np.sort(gaps['sorted_gap_positions'][:num_breaks])
+
+        trip_starts = np.union1d(plate_starts, break_positions)
+        trip_ends = np.append(trip_starts[1:], len(minutes)) - 1
+        durations = minutes[trip_ends] - minutes[trip_starts]
+        num_trips = len(trip_starts)
+
+        summary = {
+            'max_time_between_trips': threshold,
+            'trips': num_trips,
+            'mean_route_length': (len(minutes) + num_breaks) / num_trips if num_trips else np.nan,
+            'duration_mean': durations.mean() if num_trips else np.nan,
+            'duration_max': durations.max() if num_trips else np.nan,
+        }
+        quantiles = np.quantile(durations, DURATION_QUANTILES) if num_trips else [np.nan] * len(DURATION_QUANTILES)
+        for quantile, value in zip(DURATION_QUANTILES, quantiles):
+            summary[f'duration_p{int(quantile * 100)}'] = value
+        return summary
+
+
+def parse_thresholds(text):
+    return [float(value) for value in text.split(',') if value.strip()]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize trip segmentations for several trip gap thresholds.")
+    parser.add_argument('input', help="Detection CSV")
+    parser.add_argument('--thresholds', required=True, help="Comma separated MAX_TIME_BETWEEN_TRIPS values in minutes")
+    parser.add_argument('--algorithm', choices=sorted(CORRECTORS), default='levenshtein')
+    parser.add_argument('--normalize', action='store_true', help="Normalize plates before correcting them")
+    parser.add_argument('--sample-fraction', type=float, default=DEFAULT_SAMPLE_FRACTION)
+    parser.add_argument('--date-format', help="strftime format of the date column (inferred when omitted)")
+    parser.add_argument('--output', help="Write the summary to this CSV instead of printing it")
+    args = parser.parse_args(argv)
+
+    sweep = ThresholdSweep(args.input, sample_fraction=args.sample_fraction, date_format=args.date_format)
+    summary = sweep.run(parse_thresholds(args.thresholds), args.algorithm, args.normalize)
+    if args.output:
+        summary.to_csv(args.output, index=False)
+    else:
+        print(summary.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import numpy as np
+import pandas as pd
+
+CAMERA_GRAPH_SHAPES = ['line', 'ring', 'grid', 'random']
+NOISE_CHARACTERS = np.array(['#', '?'])
+DIRECTIONS = np.array(['forward', 'backward'])
+START_DATE = '2024-01-01'
+
+
+def build_camera_graph(num_cameras, shape='line', seed=0):
+    # Returns a padded (num_cameras, max_degree) array of neighbours and the degree of each camera.
+    rng = np.random.default_rng(seed)
+    edges = set()
+    if shape in ('line', 'ring'):
+        edges.update((i, i + 1) for i in range(num_cameras - 1))
+        if shape == 'ring' and num_cameras > 2:
+            edges.add((num_cameras - 1, 0))
+    elif shape == 'grid':
+        width = max(1, int(np.ceil(np.sqrt(num_cameras))))
+        for i in range(num_cameras):
+            if (i + 1) % width and i + 1 < num_cameras:
+                edges.add((i, i + 1))
+            if i + width < num_cameras:
+                edges.add((i, i + width))
+    elif shape == 'random':
+        edges.update((i, i + 1) for i in range(num_cameras - 1))
+        for _ in range(num_cameras):
+            a, b = rng.integers(0, num_cameras, size=2)
+            if a != b:
+                edges.add((min(a, b), max(a, b)))
+    else:
+        raise ValueError(f"Unknown camera graph shape: {shape}")
+
+    neighbours = [[] for _ in range(num_cameras)]
+    for a, b in sorted(edges):
+        neighbours[a].append(b)
+        neighbours[b].append(a)
+    for i in range(num_cameras):
+        if not neighbours[i]:
+            neighbours[i].append(i)
+
+    degree = np.array([len(n) for n in neighbours])
+    padded = np.zeros((num_cameras, degree.max()), dtype=np.int64)
+    for i, n in enumerate(neighbours):
+        padded[i, :len(n)] = n
+    return padded, degree
+
+
+def generate_plates(num_plates, rng):
+    digits = rng.integers(0, 10, size=(num_plates, 4)).astype(str)
+    letters = np.array(list('BCDFGHJKLMNPRSTVWXYZ'))[rng.integers(0, 20, size=(num_plates, 3))]
+    plates = np.char.add(np.char.add(np.char.add(digits[:, 0], digits[:, 1]), np.char.add(digits[:, 2], digits[:, 3])),
+                         np.char.add(np.char.add(letters[:, 0], letters[:, 1]), letters[:, 2]))
+    return pd.unique(plates)
+
+
+def add_ocr_noise(plates, noise_rate, rng):
+    # Replaces one or two characters with '#'/'?' in a noise_rate share of the reads.
+    plates = plates.astype(object)
+    noisy = np.flatnonzero(rng.random(len(plates)) < noise_rate)
+    for i in noisy:
+        characters = list(plates[i])
+        for position in rng.choice(len(characters), size=rng.integers(1, 3), replace=False):
+            characters[position] = rng.choice(NOISE_CHARACTERS)
+        plates[i] = ''.join(characters)
+    return plates
+
+
+def generate_detections(num_plates=1000, reads_per_plate=20, num_cameras=50, graph_shape='line', noise_rate=0.02,
+                        hop_minutes=3.0, trip_end_probability=0.1, trip_gap_minutes=600.0, seed=0):
+    rng = np.random.default_rng(seed)
+    neighbours, degree = build_camera_graph(num_cameras, graph_shape, seed)
+    plates = generate_plates(num_plates, rng)
+    num_plates = len(plates)
+
+    reads = 1 + rng.poisson(max(reads_per_plate - 1, 0), size=num_plates)
+    max_reads = reads.max()
+    cameras = np.empty((num_plates, max_reads), dtype=np.int64)
+    minutes = np.empty((num_plates, max_reads))
+    cameras[:, 0] = rng.integers(0, num_cameras, size=num_plates)
+    minutes[:, 0] = rng.uniform(0, 24 * 60, size=num_plates)
+
+    for step in range(1, max_reads):
+        previous = cameras[:, step - 1]
+        trip_ends = rng.random(num_plates) < trip_end_probability
+        next_cameras = neighbours[previous, (rng.random(num_plates) * degree[previous]).astype(np.int64)]
+        cameras[:, step] = np.where(trip_ends, rng.integers(0, num_cameras, size=num_plates), next_cameras)
+        gaps = np.where(trip_ends, rng.exponential(trip_gap_minutes, size=num_plates),
+                        rng.exponential(hop_minutes, size=num_plates))
+        minutes[:, step] = minutes[:, step - 1] + gaps
+
+    directions = np.zeros((num_plates, max_reads), dtype=np.int64)
+    directions[:, 1:] = cameras[:, 1:] < cameras[:, :-1]
+
+    valid = np.arange(max_reads) < reads[:, None]
+    plate_of_read = np.repeat(plates, reads)
+    data = pd.DataFrame({
+        'num_plate': add_ocr_noise(plate_of_read, noise_rate, rng),
+        'date': pd.Timestamp(START_DATE) + pd.to_timedelta(np.round(minutes[valid] * 60), unit='s'),
+        'camera_ID': cameras[valid] + 1,
+        'direction': DIRECTIONS[directions[valid]],
+    })
+    return data.sort_values(by='date', kind='stable').reset_index(drop=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a deterministic synthetic LPR detection CSV.")
+    parser.add_argument('output')
+    parser.add_argument('--plates', type=int, default=1000)
+    parser.add_argument('--reads-per-plate', type=float, default=20)
+    parser.add_argument('--cameras', type=int, default=50)
+    parser.add_argument('--graph-shape', choices=CAMERA_GRAPH_SHAPES, default='line')
+    parser.add_argument('--noise-rate', type=float, default=0.02)
+    parser.add_argument('--hop-minutes', type=float, default=3.0)
+    parser.add_argument('--trip-end-probability', type=float, default=0.1)
+    parser.add_argument('--trip-gap-minutes', type=float, default=600.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    data = generate_detections(args.plates, args.reads_per_plate, args.cameras, args.graph_shape, args.noise_rate,
+                               args.hop_minutes, args.trip_end_probability, args.trip_gap_minutes, args.seed)
+    data.to_csv(args.output, index=False)
+    print(f"Wrote {len(data)} detections for {data['num_plate'].nunique()} plates to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import datetime
+import re
+import numpy as np
+import pandas as pd
+
+from route_calculators import CompactRouteCalculator
+
+DAY_NS = 24 * 60 * 60 * 10 ** 9
+
+
+def to_nanoseconds(dates) -> np.ndarray:
+    return pd.to_datetime(dates).to_numpy(dtype='datetime64[ns]').astype(np.int64)
+
+
+def timestamp_nanoseconds(value):
+    return pd.Timestamp(value).as_unit('ns').value
+
+
+def time_of_day_nanoseconds(value: datetime.time):
+    return ((value.hour * 60 + value.minute) * 60 + value.second) * 10 ** 9 + value.microsecond * 1000
+
+
+def parse_query_time(text):
+    # Empty -> None, "HH:MM[:SS]" -> a time of day, anything else -> a timestamp.
+    text = text.strip()
+    if not text:
+        return None
+    if re.fullmatch(r'\d{1,2}:\d{2}(:\d{2})?', text):
+        return datetime.time(*map(int, text.split(':')))
+    return pd.Timestamp(text)
+
+
+class TripIndex:
+    # Query index over processed routes (one row per trip, as saved or as held by DataProcessor).
+    # Interval index: trips sorted by entry_date with the running maximum of exit_date, so the trips
+    # overlapping a period are found by two binary searches plus a filter of the slice between them.
+    # Inverted index: every camera passage (trip, time) grouped by camera and sorted by time, as one
+    # offsets array and flat passage arrays, so a camera's passages in a period are a binary search.
+    # Passage times are worked back from exit_date, like NetworkAnalytics, and never precede entry_date.
+    # Queries return trip positions (rows of self.data), sorted.
+    def __init__(self, data: pd.DataFrame):
+        self.data = data.reset_index(drop=True)
+        # Plates as integer codes numbered in sorted order, for queries that group or sort by plate.
+        self.plate_codes, self.plate_labels = pd.factorize(self.data['num_plate'].astype(str), sort=True)
+        entry_dates = to_nanoseconds(self.data['entry_date'])
+        exit_dates = to_nanoseconds(self.data['exit_date'])
+
+        self.entry_order = np.argsort(entry_dates, kind='stable')
+        self.sorted_entry_dates = entry_dates[self.entry_order]
+        self.sorted_exit_dates = exit_dates[self.entry_order]
+        self.running_max_exit_dates = np.maximum.accumulate(self.sorted_exit_dates) if len(self.data) else exit_dates
+
+        calculator = CompactRouteCalculator()
+        cameras, route_lengths = calculator.flatten_list_column(self.data['route'], dtype=object)
+        times, times_lengths = calculator.flatten_list_column(self.data['times'], dtype=np.float64)
+        camera_codes, camera_labels = pd.factorize(cameras.astype(str))
+        self.cameras = pd.Index(camera_labels)
+
+        # Camera k of a trip is passed times[k] + ... + times[-1] minutes before the trip's exit.
+        trip_of_camera = np.repeat(np.arange(len(self.data)), route_lengths)
+        camera_number = np.arange(len(cameras)) - (np.cumsum(route_lengths) - route_lengths)[trip_of_camera]
+        times = np.nan_to_num(times)
+        times_after = self.times_to_trip_end(times, times_lengths)
+        remaining = np.zeros(len(cameras))
+        has_time = camera_number < times_lengths[trip_of_camera]
+        times_starts = np.cumsum(times_lengths) - times_lengths
+        remaining[has_time] = times_after[times_starts[trip_of_camera[has_time]] + camera_number[has_time]]
+        # Rounded to whole seconds, the resolution of LPR timestamps, to drop float error from the times.
+        passage_times = exit_dates[trip_of_camera] - np.round(remaining * 60).astype(np.int64) * 10 ** 9
+        passage_times = np.maximum(passage_times, entry_dates[trip_of_camera])
+
+        passage_order = np.lexsort((passage_times, camera_codes))
+        self.camera_offsets = np.concatenate([[0], np.cumsum(np.bincount(camera_codes, minlength=len(self.cameras)))])
+        self.passage_trips = trip_of_camera[passage_order]
+        self.passage_times = passage_times[passage_order]
+
+    def times_to_trip_end(self, times, times_lengths):
+        # For every hop time, the sum of it and the later hop times of the same trip.
+        trip_ends = np.cumsum(times_lengths)
+        totals = np.cumsum(times)
+        trip_totals = np.zeros(len(times_lengths))
+        has_times = times_lengths > 0
+        trip_totals[has_times] = totals[trip_ends[has_times] - 1]
+        return np.repeat(trip_totals, times_lengths) - totals + times
+
+    def get_trips(self, positions) -> pd.DataFrame:
+        return self.data.iloc[positions]
+
+    def trips_overlapping(self, start, end):
+        start, end = timestamp_nanoseconds(start), timestamp_nanoseconds(end)
+        first = np.searchsorted(self.running_max_exit_dates, start, side='left')
+        last = np.searchsorted(self.sorted_entry_dates, end, side='right')
+        candidates = np.arange(first, max(first, last))
+        candidates = candidates[self.sorted_exit_dates[candidates] >= start]
+        return np.sort(self.entry_order[candidates])
+
+    def camera_passages(self, camera):
+        code = self.cameras.get_indexer([str(camera)])[0]
+        if code < 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        passages = slice(self.camera_offsets[code], self.camera_offsets[code + 1])
+        return self.passage_trips[passages], self.passage_times[passages]
+
+    def trips_through_camera(self, camera, start=None, end=None):
+        trips, times = self.camera_passages(camera)
+        first = np.searchsorted(times, timestamp_nanoseconds(start), side='left') if start is not None else 0
+        last = np.searchsorted(times, timestamp_nanoseconds(end), side='right') if end is not None else len(times)
+        return np.unique(trips[first:last])
+
+    def trips_through_camera_at(self, camera, start_time: datetime.time, end_time: datetime.time):
+        # Passages at a time of day on any date; a window like 23:00-01:00 wraps past midnight.
+        trips, times = self.camera_passages(camera)
+        time_of_day = times % DAY_NS
+        start, end = time_of_day_nanoseconds(start_time), time_of_day_nanoseconds(end_time)
+        if start <= end:
+            matches = (time_of_day >= start) & (time_of_day <= end)
+        else:
+            matches = (time_of_day >= start) | (time_of_day <= end)
+        return np.unique(trips[matches])
+
+    def plates_through_sequence(self, first_camera, second_camera, within_minutes) -> pd.DataFrame:
+        # Every passage of first_camera followed by a later passage of second_camera by the same plate
+        # within within_minutes, in any of its trips; matched with the earliest such passage. A read
+        # shared by two route entries (a trip's repeated first camera) counts once.
+        columns = ['num_plate', 'first_trip', 'first_time', 'second_trip', 'second_time']
+        passages = []
+        for camera in (first_camera, second_camera):
+            trips, times = self.camera_passages(camera)
+            camera_passages = pd.DataFrame({'plate': self.plate_codes[trips], 'trip': trips, 'time': pd.to_datetime(times)})
+            passages.append(camera_passages.drop_duplicates(['plate', 'time']).sort_values('time', kind='stable'))
+        first, second = passages
+        if first.empty or second.empty:
+            return pd.DataFrame(columns=columns)
+
+        matches = pd.merge_asof(first, second.assign(second_time=second['time']), on='time', by='plate',
+                                direction='forward', allow_exact_matches=False,
+                                tolerance=pd.Timedelta(minutes=within_minutes), suffixes=('', '_second'))
+        matches = matches.dropna(subset=['second_time']).sort_values(['plate', 'time'], ignore_index=True)
+        return pd.DataFrame({
+            'num_plate': self.plate_labels[matches['plate'].to_numpy()].to_numpy(),
+            'first_trip': matches['trip'].to_numpy(),
+            'first_time': matches['time'].to_numpy(),
+            'second_trip': matches['trip_second'].astype(np.int64).to_numpy(),
+            'second_time': matches['second_time'].to_numpy(),
+        }, columns=columns)
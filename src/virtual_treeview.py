@@ -0,0 +1,140 @@
+from tkinter import ttk
+import numpy as np
+import pandas as pd
+
+DEFAULT_ROW_HEIGHT = 20
+BUFFER_ROWS = 10
+WHEEL_ROWS = 3
+SORT_COLUMNS = ['num_plate', 'entry_date', 'route_length']
+
+
+def format_value(value):
+    if isinstance(value, np.ndarray):
+        value = value.tolist()
+    return str(value)
+
+
+class VirtualTreeview(ttk.Frame):
+    # Keeps the rows in a DataFrame and only inserts the visible window (plus a small buffer)
+    # into the Treeview; filtering and sorting run on the DataFrame, never on the widget.
+    def __init__(self, master, **kwargs):
+        super().__init__(master, **kwargs)
+        self.tree = ttk.Treeview(self, show='headings')
+        self.tree.pack(side='left', fill='both', expand=True)
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.on_scroll)
+        self.scrollbar.pack(side='right', fill='y')
+
+        self.data = pd.DataFrame()
+        self.route_lengths = pd.Series(dtype='int64')
+        self.positions = np.arange(0)
+        self.start = 0
+        self.visible_rows = 1
+        self.plate_filter = ''
+        self.row_filter = None
+        self.sort_column = None
+        self.sort_ascending = True
+
+        self.tree.bind('<Configure>', self.on_resize)
+        self.tree.bind('<MouseWheel>', self.on_mouse_wheel)
+        self.tree.bind('<Button-4>', lambda event: self.scroll_by(-WHEEL_ROWS))
+        self.tree.bind('<Button-5>', lambda event: self.scroll_by(WHEEL_ROWS))
+
+    def set_data(self, data: pd.DataFrame):
+        self.data = data.reset_index(drop=True)
+        self.row_filter = None
+        self.route_lengths = self.data['route'].map(len) if 'route' in self.data.columns else pd.Series(0, index=self.data.index)
+
+        self.tree["columns"] = list(self.data.columns)
+        for col in self.tree["columns"]:
+            self.tree.heading(col, text=col, command=lambda col=col: self.toggle_sort(col))
+            self.tree.column(col, width=100)
+
+        self.refresh_view()
+
+    def set_plate_filter(self, plate_filter):
+        self.plate_filter = plate_filter.strip()
+        self.refresh_view()
+
+    def set_row_filter(self, positions):
+        # Only show these rows of the data (e.g. the result of a trip query); None shows all rows.
+        self.row_filter = None if positions is None else np.asarray(positions)
+        self.refresh_view()
+
+    def sort_by(self, column, ascending=True):
+        self.sort_column = column
+        self.sort_ascending = ascending
+        self.refresh_view()
+
+    def toggle_sort(self, column):
+        ascending = not self.sort_ascending if self.sort_column == column else True
+        self.sort_by(column, ascending)
+
+    def get_sort_keys(self, column):
+        if column == 'route_length':
+            return self.route_lengths
+        return self.data[column]
+
+    def refresh_view(self):
+        positions = np.arange(len(self.data))
+        if self.row_filter is not None:
+            positions = positions[np.isin(positions, self.row_filter)]
+        if self.plate_filter and 'num_plate' in self.data.columns:
+            mask = self.data['num_plate'].astype(str).str.contains(self.plate_filter, case=False, regex=False)
+            positions = positions[mask.to_numpy()[positions]]
+
+        if self.sort_column is not None and len(positions):
+            keys = self.get_sort_keys(self.sort_column).iloc[positions].reset_index(drop=True)
+            order = keys.sort_values(ascending=self.sort_ascending, kind='stable').index.to_numpy()
+            positions = positions[order]
+
+        self.positions = positions
+        self.start = 0
+        self.render_window()
+
+    def render_window(self):
+        self.tree.delete(*self.tree.get_children())
+        end = min(len(self.positions), self.start + self.visible_rows + BUFFER_ROWS)
+        window = self.data.iloc[self.positions[self.start:end]]
+
+        for position, values in zip(window.index, window.itertuples(index=False, name=None)):
+            self.tree.insert("", "end", iid=str(position), values=[format_value(value) for value in values])
+
+        total = max(len(self.positions), 1)
+        self.scrollbar.set(self.start / total, min(self.start + self.visible_rows, total) / total)
+
+    def scroll_to(self, start):
+        start = max(0, min(start, len(self.positions) - self.visible_rows))
+        if start != self.start:
+            self.start = start
+            self.render_window()
+
+    def scroll_by(self, rows):
+        self.scroll_to(self.start + rows)
+        return 'break'
+
+    def on_scroll(self, action, amount, unit=None):
+        if action == 'moveto':
+            self.scroll_to(int(float(amount) * len(self.positions)))
+        elif action == 'scroll':
+            step = self.visible_rows if unit == 'pages' else 1
+            self.scroll_to(self.start + int(amount) * step)
+
+    def on_mouse_wheel(self, event):
+        return self.scroll_by(-int(np.sign(event.delta)) * WHEEL_ROWS)
+
+    def on_resize(self, event):
+        row_height = ttk.Style(self).lookup('Treeview', 'rowheight') or DEFAULT_ROW_HEIGHT
+        visible_rows = max(1, int(event.height) // int(row_height))
+        if visible_rows != self.visible_rows:
+            self.visible_rows = visible_rows
+            self.render_window()
+
+    def get_neighbour_values(self, iid, column, count):
+        # Values of column for up to count rows on each side of the row iid, in view order, nearest first.
+        index = np.flatnonzero(self.positions == int(iid))
+        if not len(index) or column not in self.data.columns:
+            return []
+        index = index[0]
+        neighbours = [neighbour for offset in range(1, count + 1) for neighbour in (index + offset, index - offset)
+                      if 0 <= neighbour < len(self.positions)]
+        return self.data[column].iloc[self.positions[neighbours]].tolist()
@@ -0,0 +1,57 @@
+import random
+
+import pandas as pd
+import pytest
+
+from correctors import CORRECTORS
+
+ALPHABET = 'ABCDEFGHJKLMNPRSTVWXYZ0123456789'
+
+
+def random_plates(rng):
+    clean = [''.join(rng.choice(ALPHABET) for _ in range(rng.choice([3, 6, 7, 8]))) for _ in range(80)]
+    dirty = []
+    for _ in range(40):
+        plate = list(rng.choice(clean))
+        for _ in range(rng.randint(1, 3)):
+            position = rng.randrange(len(plate) + 1)
+            operation = rng.random()
+            if operation < 0.4 and position < len(plate):
+                plate[position] = rng.choice('#*-')
+            elif operation < 0.7:
+                plate.insert(position, rng.choice('#*'))
+            elif operation < 0.85 and position < len(plate):
+                del plate[position]
+            elif position + 1 < len(plate):
+                plate[position], plate[position + 1] = plate[position + 1], plate[position]
+        dirty.append(''.join(plate))
+    plates = clean + dirty
+    rng.shuffle(plates)
+    return plates
+
+
+def brute_force_corrections(corrector, plates):
+    # The original scan: every dirty plate against every clean plate with textdistance, first minimum wins.
+    distinct_plates = list(dict.fromkeys(plates))
+    is_dirty = [bool(corrector.non_alphanumeric_regex.search(plate.lower())) for plate in distinct_plates]
+    clean_plates = [plate for plate, dirty in zip(distinct_plates, is_dirty) if not dirty]
+    corrections = {}
+    for plate in (plate for plate, dirty in zip(distinct_plates, is_dirty) if dirty):
+        distances = [corrector.calculate_distance(plate, clean_plate) for clean_plate in clean_plates]
+        if distances and min(distances) <= len(corrector.non_alphanumeric_regex.findall(plate)):
+            corrections[plate] = clean_plates[distances.index(min(distances))]
+    return corrections
+
+
+@pytest.mark.parametrize('algorithm', sorted(CORRECTORS))
+@pytest.mark.parametrize('workers', [1, 2])
+def test_corrections_match_brute_force_scan(algorithm, workers):
+    rng = random.Random(7)
+    for _ in range(5):
+        plates = random_plates(rng)
+        corrector = CORRECTORS[algorithm](workers=workers)
+        data = corrector.correct_num_plates(pd.DataFrame({'num_plate': plates}))
+
+        expected = brute_force_corrections(corrector, plates)
+        assert corrector.correction_map == expected
+        assert data['num_plate'].tolist() == [expected.get(plate, plate) for plate in plates]
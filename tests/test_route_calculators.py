@@ -0,0 +1,67 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from correctors import LevenshteinCorrector
+from data_processor import DataProcessor
+from route_calculators import SimpleRouteCalculator, VectorizedRouteCalculator, CompactRouteCalculator
+
+MAX_TIME_BETWEEN_TRIPS = 120
+INSERTIONS = {(1, 3): [2], (4, 1): [5, 6], (2, 2): [4]}
+STRING_INSERTIONS = {(f'C{first}', f'C{second}'): [f'C{camera}' for camera in cameras]
+                     for (first, second), cameras in INSERTIONS.items()}
+
+
+def random_detections(seed=0, num_rows=400, string_cameras=False):
+    rng = np.random.default_rng(seed)
+    detections = pd.DataFrame({
+        'num_plate': rng.choice([f'P{plate:03d}' for plate in range(10)], num_rows),
+        'date': pd.Timestamp('2024-01-01') + pd.to_timedelta(rng.integers(0, 24 * 60, num_rows), unit='min'),
+        'camera_ID': rng.integers(1, 5, num_rows),
+        'direction': rng.choice(['in', 'out'], num_rows),
+    })
+    if string_cameras:
+        detections['camera_ID'] = 'C' + detections['camera_ID'].astype(str)
+    return detections.sort_values(by=['num_plate', 'date'], kind='stable', ignore_index=True)
+
+
+def as_records(routes):
+    # Python lists and Arrow list columns, numpy and pandas timestamps all compare as plain values.
+    return [{column: list(value) if column in ('route', 'times', 'directions') else pd.Timestamp(value)
+             if column.endswith('_date') else value for column, value in row.items()}
+            for row in routes.to_dict('records')]
+
+
+def assert_same_routes(routes, expected):
+    assert list(routes.columns) == list(expected.columns)
+    assert len(routes) == len(expected)
+    for row, expected_row in zip(as_records(routes), as_records(expected)):
+        assert row['route'] == expected_row['route']
+        assert row['times'] == pytest.approx(expected_row['times'], rel=1e-6)
+        assert {column: value for column, value in row.items() if column not in ('route', 'times')} == \
+            {column: value for column, value in expected_row.items() if column not in ('route', 'times')}
+
+
+@pytest.mark.parametrize('route_calculator', [VectorizedRouteCalculator, CompactRouteCalculator])
+@pytest.mark.parametrize('string_cameras', [False, True])
+def test_calculators_match_simple(route_calculator, string_cameras):
+    detections = random_detections(string_cameras=string_cameras)
+    insertions = STRING_INSERTIONS if string_cameras else INSERTIONS
+    expected = SimpleRouteCalculator().calculate_routes(detections, MAX_TIME_BETWEEN_TRIPS)
+    routes = route_calculator().calculate_routes(detections, MAX_TIME_BETWEEN_TRIPS)
+    assert_same_routes(routes, expected)
+
+    expected = SimpleRouteCalculator().adjust_routes(expected, insertions)
+    assert_same_routes(route_calculator().adjust_routes(routes, insertions), expected)
+
+
+@pytest.mark.parametrize('route_calculator', [VectorizedRouteCalculator, CompactRouteCalculator])
+def test_parallel_routes_match_simple(route_calculator):
+    detections = random_detections(seed=1)
+    simple = SimpleRouteCalculator()
+    expected = simple.adjust_routes(simple.calculate_routes(detections, MAX_TIME_BETWEEN_TRIPS), INSERTIONS)
+
+    processor = DataProcessor(None, LevenshteinCorrector(), route_calculator(), route_workers=2)
+    processor.data = detections
+    processor.calculate_and_adjust_routes(MAX_TIME_BETWEEN_TRIPS, INSERTIONS)
+    assert_same_routes(processor.data, expected)